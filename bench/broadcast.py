@@ -0,0 +1,89 @@
+# telegram_reviews_bot/bench/broadcast.py
+"""Стенд для движка рассылок: фейковая сессия Bot API вместо api.telegram.org, замер пропускной способности.
+
+    python -m bench.broadcast            # 2000 пользователей, 40 мс на запрос, 1% ответов 429
+    BENCH_USERS=50000 python -m bench.broadcast
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("DATABASE_URL", "postgres://bench@localhost/bench")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE, OUTBOUND_GLOBAL_RATE
+from utils.broadcast import Broadcaster, SENT
+from utils.outbound import BULK, outbound, with_priority
+
+USERS = int(os.getenv("BENCH_USERS", "2000"))
+LATENCY = float(os.getenv("BENCH_LATENCY", "0.04"))
+RETRY_AFTER_RATE = float(os.getenv("BENCH_RETRY_AFTER_RATE", "0.01"))
+
+
+class FakeSession(BaseSession):
+    """Отвечает на sendMessage без сети: задержка LATENCY и изредка 429 Too Many Requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+        self.retry_after = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        await asyncio.sleep(LATENCY)
+        if not isinstance(method, SendMessage):
+            raise NotImplementedError(type(method).__name__)
+        if random.random() < RETRY_AFTER_RATE:
+            self.retry_after += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        return Message(
+            message_id=self.requests,
+            date=datetime.now(),
+            chat=Chat(id=method.chat_id, type="private"),
+            text=method.text,
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def main():
+    session = FakeSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    # Лимит скорости и повторы после 429 — как у настоящего бота (create_bot в bot.py)
+    bot.session.middleware(outbound)
+    broadcaster = Broadcaster(concurrency=BROADCAST_CONCURRENCY, chunk_size=BROADCAST_CHUNK_SIZE)
+
+    # Тот же путь, что у воркера рассылок, но без БД: пачки по BROADCAST_CHUNK_SIZE подряд
+    user_ids = list(range(1, USERS + 1))
+    delivered = failed = 0
+    started = time.perf_counter()
+    with with_priority(BULK):
+        for i in range(0, USERS, BROADCAST_CHUNK_SIZE):
+            results = await broadcaster.send_batch(bot, user_ids[i:i + BROADCAST_CHUNK_SIZE], "Рассылка")
+            delivered += sum(1 for result in results.values() if result == SENT)
+            failed += sum(1 for result in results.values() if result != SENT)
+    elapsed = time.perf_counter() - started
+
+    print(f"users: {USERS}, rate limit: {OUTBOUND_GLOBAL_RATE}/s, concurrency: {BROADCAST_CONCURRENCY}, chunk: {BROADCAST_CHUNK_SIZE}")
+    print(f"delivered: {delivered}, failed: {failed}, 429 responses: {session.retry_after}, elapsed: {elapsed:.1f}s")
+    print(f"throughput: {delivered / elapsed:.1f} msg/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
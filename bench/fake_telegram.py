@@ -0,0 +1,348 @@
+# telegram_reviews_bot/bench/fake_telegram.py
+"""Фейковый сервер Bot API на aiohttp для стендов, где бот запускается целиком (TELEGRAM_API_URL).
+
+Отдаёт через getUpdates поставленные стендом обновления (сообщения, фото, нажатия кнопок), хранит
+сообщения бота по чатам, чтобы стенд мог «нажимать» его кнопки, и отдаёт файлы для getFile.
+Каждому запросу добавляется задержка, часть отправок и правок отвечает 429 Too Many Requests.
+
+    python -m bench.fake_telegram        # слушает 127.0.0.1:8081
+    FAKE_TELEGRAM_LATENCY_MS=80 FAKE_TELEGRAM_429_RATE=0.01 python -m bench.load_test
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from aiohttp import web
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+HOST = os.getenv("FAKE_TELEGRAM_HOST", "127.0.0.1")
+PORT = int(os.getenv("FAKE_TELEGRAM_PORT", "8081"))
+# Задержка ответа на каждый запрос (кроме ожидания в getUpdates): LATENCY_MS + случайно до JITTER_MS
+LATENCY_MS = float(os.getenv("FAKE_TELEGRAM_LATENCY_MS", "40"))
+JITTER_MS = float(os.getenv("FAKE_TELEGRAM_JITTER_MS", "20"))
+# Доля отправок и правок, на которые отвечаем 429, и retry_after в ответе
+RETRY_AFTER_RATE = float(os.getenv("FAKE_TELEGRAM_429_RATE", "0"))
+RETRY_AFTER_SEC = int(os.getenv("FAKE_TELEGRAM_RETRY_AFTER_SEC", "1"))
+BOT_ID = 123456
+# Сколько ждать новых обновлений в getUpdates, даже если бот просит больше
+MAX_POLLING_TIMEOUT_SEC = 5
+
+# Методы, на которые настоящий Telegram отвечает 429 при превышении лимитов
+RATE_LIMITED_METHODS = {
+    "sendMessage", "sendPhoto", "editMessageText", "editMessageCaption", "editMessageMedia",
+    "editMessageReplyMarkup",
+}
+
+
+class BotApiError(Exception):
+    def __init__(self, status: int, description: str, retry_after: int | None = None):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+def _markup(params: dict) -> dict | None:
+    markup = params.get("reply_markup")
+    return json.loads(markup) if isinstance(markup, str) else markup
+
+
+def find_button(message: dict, prefix: str, text_contains: str = "") -> str | None:
+    """callback_data первой inline-кнопки, у которой callback_data начинается с prefix."""
+    markup = message.get("reply_markup") or {}
+    for row in markup.get("inline_keyboard", []):
+        for button in row:
+            data = button.get("callback_data", "")
+            if data.startswith(prefix) and text_contains in button["text"]:
+                return data
+    return None
+
+
+class FakeTelegram:
+    """Bot API в памяти: getUpdates с long polling, отправка и правка сообщений, getFile и скачивание файлов."""
+
+    def __init__(self, latency_ms: float = LATENCY_MS, jitter_ms: float = JITTER_MS,
+                 retry_after_rate: float = RETRY_AFTER_RATE):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.retry_after_rate = retry_after_rate
+        self.updates: list[dict] = []
+        self._next_update_id = 1
+        self.updates_pushed = 0
+        self._next_message_id = 1
+        self._next_file_id = 1
+        self._new_updates = asyncio.Event()
+        # (chat_id, message_id) -> текущее состояние сообщения бота
+        self.messages: dict[tuple[int, int], dict] = {}
+        # chat_id -> все отправки и правки бота в этом чате по порядку: {"method", "message", "time"}
+        self.outbox: defaultdict[int, list[dict]] = defaultdict(list)
+        self._outbox_changed: defaultdict[int, asyncio.Condition] = defaultdict(asyncio.Condition)
+        self.sent_messages: Counter[int] = Counter()  # chat_id -> сколько сообщений отправил бот
+        self.requests: Counter[str] = Counter()
+        self.rate_limited: Counter[str] = Counter()
+        self._files: dict[str, bytes] = {}
+
+    # --- Обновления от «пользователей» ---
+
+    def _push_update(self, kind: str, payload: dict) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self.updates_pushed += 1
+        self.updates.append({"update_id": update_id, kind: payload})
+        self._new_updates.set()
+        return update_id
+
+    @staticmethod
+    def _user(chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}", "username": f"bench{chat_id}"}
+
+    def _user_message(self, chat_id: int, **content) -> dict:
+        return {
+            "message_id": self._next_update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            **content,
+        }
+
+    def push_message(self, chat_id: int, text: str) -> int:
+        """Ставит в очередь текстовое сообщение от пользователя chat_id. Возвращает update_id."""
+        content = {"text": text}
+        if text.startswith("/"):
+            content["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push_update("message", self._user_message(chat_id, **content))
+
+    def push_photo(self, chat_id: int, caption: str | None = None) -> int:
+        """Ставит в очередь фото от пользователя; сам файл отдаётся через getFile."""
+        file_id = self._new_file_id("user_photo")
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+        content = {"photo": photo, **({"caption": caption} if caption else {})}
+        return self._push_update("message", self._user_message(chat_id, **content))
+
+    def push_callback(self, chat_id: int, message_id: int, data: str) -> int:
+        """Ставит в очередь нажатие inline-кнопки с callback_data под сообщением бота."""
+        return self._push_update("callback_query", {
+            "id": str(self._next_update_id),
+            "from": self._user(chat_id),
+            "chat_instance": str(chat_id),
+            "message": self.messages[(chat_id, message_id)],
+            "data": data,
+        })
+
+    async def wait_for(self, chat_id: int, predicate, start: int = 0, timeout: float = 30) -> tuple[int, dict]:
+        """Ждёт отправку или правку бота в чате (начиная с outbox[chat_id][start]), для которой predicate истинен.
+
+        Возвращает (индекс в outbox, событие). По истечении timeout — asyncio.TimeoutError.
+        """
+        condition = self._outbox_changed[chat_id]
+        outbox = self.outbox[chat_id]
+        position = start
+
+        def find():
+            nonlocal position
+            while position < len(outbox):
+                if predicate(outbox[position]):
+                    return True
+                position += 1
+            return False
+
+        async with condition:
+            await asyncio.wait_for(condition.wait_for(find), timeout=timeout)
+        return position, outbox[position]
+
+    # --- Файлы ---
+
+    def _new_file_id(self, prefix: str) -> str:
+        file_id = f"{prefix}_{self._next_file_id}"
+        self._next_file_id += 1
+        return file_id
+
+    def _file_bytes(self, file_id: str) -> bytes:
+        # У каждого file_id своя картинка, чтобы хранилище бота не схлопнуло их по хэшу
+        if file_id not in self._files:
+            color = tuple(hashlib.sha256(file_id.encode()).digest()[:3])
+            buffer = io.BytesIO()
+            Image.new("RGB", (640, 480), color).save(buffer, "JPEG", quality=85)
+            self._files[file_id] = buffer.getvalue()
+        return self._files[file_id]
+
+    def _photo(self, file_id: str) -> list[dict]:
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+
+    # --- Сообщения бота ---
+
+    async def _record(self, chat_id: int, method: str, message: dict):
+        self.outbox[chat_id].append({"method": method, "message": dict(message), "time": time.perf_counter()})
+        condition = self._outbox_changed[chat_id]
+        async with condition:
+            condition.notify_all()
+
+    async def _send(self, method: str, params: dict, **content) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+            **content,
+        }
+        if markup := _markup(params):
+            message["reply_markup"] = markup
+        self._next_message_id += 1
+        self.messages[(chat_id, message["message_id"])] = message
+        self.sent_messages[chat_id] += 1
+        await self._record(chat_id, method, message)
+        return message
+
+    async def _edit(self, method: str, params: dict, **content) -> dict:
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        message = self.messages.get((chat_id, message_id))
+        if message is None:
+            raise BotApiError(400, "Bad Request: message to edit not found")
+        markup = _markup(params)
+        if all(message.get(key) == value for key, value in content.items()) and message.get("reply_markup") == markup:
+            raise BotApiError(400, "Bad Request: message is not modified")
+        if "photo" in content:
+            message.pop("text", None)
+        message.update(content, edit_date=int(time.time()))
+        if markup:
+            message["reply_markup"] = markup
+        else:
+            message.pop("reply_markup", None)
+        await self._record(chat_id, method, message)
+        return message
+
+    def _uploaded_photo(self, value: str | None) -> str:
+        """file_id фото из параметра: загруженный файл (attach://…) и URL получают новый file_id."""
+        if value and not value.startswith("attach://") and "://" not in value:
+            return value
+        return self._new_file_id("uploaded")
+
+    async def call(self, method: str, params: dict):
+        """Выполняет метод Bot API, возвращает result или бросает BotApiError."""
+        if method == "getUpdates":
+            return await self._get_updates(params)
+
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if method in RATE_LIMITED_METHODS and random.random() < self.retry_after_rate:
+            self.rate_limited[method] += 1
+            raise BotApiError(429, f"Too Many Requests: retry after {RETRY_AFTER_SEC}", retry_after=RETRY_AFTER_SEC)
+
+        if method == "sendMessage":
+            return await self._send(method, params, text=params.get("text", ""))
+        if method == "sendPhoto":
+            photo = self._uploaded_photo(params.get("photo"))
+            return await self._send(method, params, photo=self._photo(photo), caption=params.get("caption", ""))
+        if method == "editMessageText":
+            return await self._edit(method, params, text=params.get("text", ""))
+        if method == "editMessageCaption":
+            return await self._edit(method, params, caption=params.get("caption", ""))
+        if method == "editMessageReplyMarkup":
+            return await self._edit(method, params)
+        if method == "editMessageMedia":
+            media = json.loads(params["media"]) if isinstance(params["media"], str) else params["media"]
+            photo = self._uploaded_photo(media.get("media"))
+            return await self._edit(method, params, photo=self._photo(photo), caption=media.get("caption", ""))
+        if method == "deleteMessage":
+            self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+            return True
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self._file_bytes(file_id)),
+                "file_path": f"photos/{file_id}.jpg",
+            }
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("deleteWebhook", "setWebhook", "setMyCommands", "answerCallbackQuery"):
+            return True
+        raise BotApiError(404, f"Not Found: method {method} is not supported")
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), MAX_POLLING_TIMEOUT_SEC)
+        # Подтверждённые обновления (update_id < offset) больше не отдаём
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    # --- HTTP ---
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            # Файлы (attach://…) приходят полями multipart; сами байты стенду не нужны
+            params = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        try:
+            result = await self.call(method, params)
+        except BotApiError as e:
+            body = {"ok": False, "error_code": e.status, "description": e.description}
+            if e.retry_after is not None:
+                body["parameters"] = {"retry_after": e.retry_after}
+            return web.json_response(body, status=e.status)
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.requests["file"] += 1
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        file_id = Path(request.match_info["path"]).stem
+        return web.Response(body=self._file_bytes(file_id), content_type="image/jpeg")
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        return app
+
+    async def start(self, host: str = HOST, port: int = PORT) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+async def start_bot_processes(count: int = 1, **env) -> list[asyncio.subprocess.Process]:
+    """Запускает count процессов bot.py (WORKER_INDEX 0..count-1), подключённых к фейковому серверу."""
+    env = {
+        **os.environ,
+        "BOT_TOKEN": os.getenv("BOT_TOKEN", f"{BOT_ID}:bench"),
+        "BOT_MODE": "polling",
+        "WORKER_COUNT": str(count),
+        "TELEGRAM_API_URL": f"http://{HOST}:{PORT}",
+        **env,
+    }
+    return [
+        await asyncio.create_subprocess_exec(
+            sys.executable, str(ROOT / "bot.py"), cwd=ROOT, env={**env, "WORKER_INDEX": str(index)},
+        )
+        for index in range(count)
+    ]
+
+
+async def stop_bot_processes(processes: list[asyncio.subprocess.Process]):
+    for process in processes:
+        if process.returncode is None:
+            process.terminate()
+    await asyncio.gather(*(process.wait() for process in processes))
+
+
+if __name__ == "__main__":
+    web.run_app(FakeTelegram().make_app(), host=HOST, port=PORT)
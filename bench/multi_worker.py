@@ -0,0 +1,68 @@
+# telegram_reviews_bot/bench/multi_worker.py
+"""Стенд для нескольких процессов бота: N копий bot.py с общей очередью обновлений и фейковым Bot API.
+
+Нужен настоящий Postgres (DATABASE_URL). Стенд поднимает bench/fake_telegram.py, запускает
+WORKER_COUNT=N процессов, отправляет /start от разных чатов и проверяет, что каждый чат получил
+ровно столько ответов, сколько отправил команд (без потерь и дублей), и сколько это заняло.
+
+    DATABASE_URL=postgres://... python -m bench.multi_worker        # 3 воркера, 200 чатов по 5 /start
+    BENCH_WORKERS=4 BENCH_CHATS=1000 python -m bench.multi_worker
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fake_telegram import FakeTelegram, start_bot_processes, stop_bot_processes
+
+WORKERS = int(os.getenv("BENCH_WORKERS", "3"))
+CHATS = int(os.getenv("BENCH_CHATS", "200"))
+MESSAGES_PER_CHAT = int(os.getenv("BENCH_MESSAGES_PER_CHAT", "5"))
+DEADLINE_SEC = float(os.getenv("BENCH_DEADLINE_SEC", "120"))
+# Первые chat_id стенда; у настоящих пользователей таких не бывает
+CHAT_ID_BASE = 10_000_000_000
+
+
+async def main():
+    if not os.getenv("DATABASE_URL"):
+        sys.exit("DATABASE_URL is required: the workers share the update queue in Postgres")
+
+    telegram = FakeTelegram()
+    runner = await telegram.start()
+    workers = await start_bot_processes(WORKERS)
+    try:
+        # Ждём, пока один из процессов начнёт получать обновления
+        while telegram.requests["getUpdates"] == 0:
+            await asyncio.sleep(0.2)
+
+        expected = {CHAT_ID_BASE + i: MESSAGES_PER_CHAT for i in range(CHATS)}
+        started = time.perf_counter()
+        for _ in range(MESSAGES_PER_CHAT):
+            for chat_id in expected:
+                telegram.push_message(chat_id, "/start")
+
+        total = CHATS * MESSAGES_PER_CHAT
+        while time.perf_counter() - started < DEADLINE_SEC:
+            if sum(telegram.sent_messages[chat_id] for chat_id in expected) >= total:
+                break
+            await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+
+        missing = {c: n - telegram.sent_messages[c] for c, n in expected.items() if telegram.sent_messages[c] < n}
+        duplicated = {c: telegram.sent_messages[c] - n for c, n in expected.items() if telegram.sent_messages[c] > n}
+        print(f"Воркеров: {WORKERS}, чатов: {CHATS}, обновлений: {total}")
+        print(f"Ответов: {sum(telegram.sent_messages[c] for c in expected)} за {elapsed:.2f} с "
+              f"({total / elapsed:.0f} обновлений/с)")
+        print(f"Чатов с потерями: {len(missing)}, с дублями: {len(duplicated)}")
+        if missing or duplicated:
+            sys.exit(1)
+    finally:
+        await stop_bot_processes(workers)
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
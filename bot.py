@@ -1,47 +1,71 @@
 # telegram_reviews_bot/bot.py
 import asyncio
 import logging
+import signal
 import socket
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.exceptions import TelegramNetworkError
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiohttp import ClientTimeout, TCPConnector
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, FSM_STORAGE, BOT_MODE, TELEGRAM_API_URL, WORKER_COUNT, WORKER_INDEX, METRICS_HOST, METRICS_PORT,
+)
 import database as db
 from handlers import start, reviews, admin, show_reviews
+from utils.activity import activity
+from utils.broadcast import broadcaster
+from utils.loader import LoaderEditGuard
+from utils.outbound import outbound
+from utils.metrics import ApiMetricsMiddleware, setup_dispatcher_metrics, start_metrics_server
+from utils.media import run_media_gc_periodically
+from utils.fsm_storage import create_fsm_storage
+from utils.webhook import WebhookServer
+from utils.workers import SharedUpdateConsumer, enqueue_update, poll_into_queue
+from utils.maintenance import (
+    run_review_stats_reconcile_periodically,
+    run_user_activity_maintenance_periodically,
+    run_fsm_storage_cleanup_periodically,
+    run_update_queue_cleanup_periodically,
+)
 
-async def main():
-    # Настройка логирования
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
-    
-    # Инициализация базы данных
-    await db.init_db()
+class IPv4AiohttpSession(AiohttpSession):
+    """AiohttpSession, которая ходит в Bot API только по IPv4.
+
+    В aiogram 3.4 параметры коннектора задаются не через конструктор, а в _connector_init.
+    """
 
-    # Инициализация диспетчера
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init["family"] = socket.AF_INET
 
-    # Регистрация роутеров
-    dp.include_router(start.router)
-    dp.include_router(reviews.router)
-    dp.include_router(show_reviews.router)
-    dp.include_router(admin.router) # Админский роутер должен быть последним, чтобы его фильтры не мешали другим
+def create_bot() -> Bot:
+    session_kwargs = {"timeout": 75}
+    if TELEGRAM_API_URL:
+        # Свой сервер Bot API (например, bench/fake_telegram.py для нагрузочных тестов)
+        session_kwargs["api"] = TelegramAPIServer.from_base(TELEGRAM_API_URL)
+    bot = Bot(
+        token=BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode="HTML"),
+        session=IPv4AiohttpSession(**session_kwargs),
+    )
+    # Правка сообщения обработчиком останавливает анимацию лоадера на нём (utils/loader.py)
+    bot.session.middleware(LoaderEditGuard())
+    # Лимиты Telegram на чат и на бота, приоритеты и повтор после 429 (utils/outbound.py)
+    bot.session.middleware(outbound)
+    # Время и ошибки каждого запроса к Bot API (включая повторы после 429) — в /metrics
+    bot.session.middleware(ApiMetricsMiddleware())
+    return bot
 
+async def run_polling(dp: Dispatcher):
     # На Render иногда бывает сетевой таймаут до api.telegram.org (особенно при IPv6/маршрутизации).
     # Чтобы воркер не "умирал", делаем корректную настройку сессии и перезапуск поллинга при сетевых ошибках.
     reconnect_delay_sec = 15
     while True:
-        bot = Bot(
-            token=BOT_TOKEN,
-            default=DefaultBotProperties(parse_mode="HTML"),
-            session=AiohttpSession(
-                timeout=ClientTimeout(total=75),
-                connector=TCPConnector(family=socket.AF_INET),
-            ),
-        )
+        bot = create_bot()
+        # Фоновый воркер рассылок (продолжит задания, прерванные перезапуском)
+        broadcaster.start(bot)
         try:
             # Удаление вебхука и запуск поллинга
             try:
@@ -68,5 +92,108 @@ async def main():
             except Exception:
                 pass
 
+async def run_webhook(dp: Dispatcher):
+    # Один Bot на всё время работы: сетевые ошибки к api.telegram.org касаются отдельных запросов,
+    # а обновления приходят входящими HTTP-запросами от Telegram
+    bot = create_bot()
+    broadcaster.start(bot)
+    try:
+        await WebhookServer(dp, bot).run()
+    finally:
+        await bot.session.close()
+
+async def run_workers(dp: Dispatcher):
+    # Один из нескольких процессов (WORKER_COUNT > 1): принимаем обновления в общую очередь
+    # и обрабатываем свои шарды из неё (см. utils/workers.py)
+    bot = create_bot()
+    broadcaster.start(bot)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    if BOT_MODE == "webhook":
+        ingress = asyncio.create_task(WebhookServer(dp, bot, enqueue=enqueue_update).run(stop))
+    else:
+        ingress = asyncio.create_task(poll_into_queue(bot, dp, stop))
+    consumer = asyncio.create_task(SharedUpdateConsumer(dp, bot).run(stop))
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        # Работаем до сигнала остановки или пока одна из задач не завершилась с ошибкой
+        done, _ = await asyncio.wait([ingress, consumer, stopped], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task is not stopped and task.exception() is not None:
+                logging.error("Worker task failed", exc_info=task.exception())
+    finally:
+        stop.set()
+        if BOT_MODE != "webhook":
+            # getUpdates может висеть до POLLING_TIMEOUT_SEC — не ждём его
+            ingress.cancel()
+        await asyncio.gather(ingress, consumer, stopped, return_exceptions=True)
+        await bot.session.close()
+
+async def main():
+    # Настройка логирования
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    
+    # Инициализация базы данных (создаёт общий пул соединений)
+    await db.init_db()
+
+    # Фоновая запись буфера активности пользователей
+    activity.start()
+
+    # Периодическая очистка media/photos от фото удалённых отзывов
+    media_gc_task = asyncio.create_task(run_media_gc_periodically())
+    # Периодическая сверка счётчиков review_stats с таблицей reviews
+    reconcile_task = asyncio.create_task(run_review_stats_reconcile_periodically())
+    # Партиции user_activity, дневные итоги и удаление старых событий
+    activity_maintenance_task = asyncio.create_task(run_user_activity_maintenance_periodically())
+    background_tasks = [media_gc_task, reconcile_task, activity_maintenance_task]
+    if FSM_STORAGE == "postgres":
+        # Просроченные состояния FSM в таблице fsm_storage
+        background_tasks.append(asyncio.create_task(run_fsm_storage_cleanup_periodically()))
+    if WORKER_COUNT > 1:
+        # Обработанные строки общей очереди обновлений
+        background_tasks.append(asyncio.create_task(run_update_queue_cleanup_periodically()))
+
+    metrics_server = None
+    if METRICS_PORT:
+        # Локальный эндпоинт /metrics; у каждого воркера свой порт
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT + WORKER_INDEX)
+
+    try:
+        # Инициализация диспетчера
+        # Хранилище состояний FSM (memory / postgres / redis, см. FSM_STORAGE)
+        storage = create_fsm_storage()
+        dp = Dispatcher(storage=storage)
+        # Число обновлений, время и ошибки обработчиков
+        setup_dispatcher_metrics(dp)
+
+        # Регистрация роутеров
+        dp.include_router(start.router)
+        dp.include_router(reviews.router)
+        dp.include_router(show_reviews.router)
+        dp.include_router(admin.router) # Админский роутер должен быть последним, чтобы его фильтры не мешали другим
+
+        if WORKER_COUNT > 1:
+            await run_workers(dp)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp)
+        else:
+            await run_polling(dp)
+    finally:
+        # Останавливаем фоновые задачи и закрываем пул соединений к БД
+        for task in background_tasks:
+            task.cancel()
+        await broadcaster.close()
+        # Дописываем в БД накопленную активность до закрытия пула
+        await activity.close()
+        await db.close_db()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+
 if __name__ == "__main__":
     asyncio.run(main())
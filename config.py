@@ -10,6 +10,24 @@ def _get_env_required(key: str) -> str:
 		raise RuntimeError(f"Required environment variable {key} is not set")
 	return value
 
+def _get_env_int(key: str, default: int) -> int:
+	value = os.getenv(key)
+	if not value:
+		return default
+	try:
+		return int(value)
+	except ValueError:
+		raise RuntimeError(f"Environment variable {key} must be an integer, got {value!r}")
+
+def _get_env_float(key: str, default: float) -> float:
+	value = os.getenv(key)
+	if not value:
+		return default
+	try:
+		return float(value)
+	except ValueError:
+		raise RuntimeError(f"Environment variable {key} must be a number, got {value!r}")
+
 BOT_TOKEN: str = _get_env_required("BOT_TOKEN")
 
 # ADMIN_ID опционален: если не задан или неверный, будет None
@@ -19,4 +37,92 @@ try:
 except ValueError:
 	ADMIN_ID = None
 
-DATABASE_URL: str = _get_env_required("DATABASE_URL")
\ No newline at end of file
+DATABASE_URL: str = _get_env_required("DATABASE_URL")
+
+# Пул соединений к Postgres: один на процесс, создаётся в database.init_db()
+DB_POOL_MIN_SIZE: int = _get_env_int("DB_POOL_MIN_SIZE", 1)
+DB_POOL_MAX_SIZE: int = _get_env_int("DB_POOL_MAX_SIZE", 10)
+# Сколько секунд ждать свободное соединение из пула, прежде чем упасть с ошибкой
+DB_POOL_ACQUIRE_TIMEOUT: float = _get_env_float("DB_POOL_ACQUIRE_TIMEOUT", 10.0)
+
+# Рассылки: число параллельных отправок (скорость ограничивает OUTBOUND_GLOBAL_RATE)
+BROADCAST_CONCURRENCY: int = _get_env_int("BROADCAST_CONCURRENCY", 10)
+# Сколько получателей отправлять между контрольными точками (и сколько максимум может задублироваться при падении)
+BROADCAST_CHUNK_SIZE: int = _get_env_int("BROADCAST_CHUNK_SIZE", 100)
+# Исходящие запросы (utils/outbound.py): лимит бота в секунду (Telegram: ~30/с, делится между WORKER_COUNT),
+# лимит на один чат (Telegram: ~1 сообщение/с) с запасом на короткие всплески и повторы после 429
+OUTBOUND_GLOBAL_RATE: float = _get_env_float("OUTBOUND_GLOBAL_RATE", 30.0)
+OUTBOUND_CHAT_RATE: float = _get_env_float("OUTBOUND_CHAT_RATE", 1.0)
+OUTBOUND_CHAT_BURST: int = _get_env_int("OUTBOUND_CHAT_BURST", 3)
+OUTBOUND_MAX_RETRIES: int = _get_env_int("OUTBOUND_MAX_RETRIES", 3)
+# Дольше этого retry_after не ждём внутри запроса — ошибка уходит вызывающему коду
+OUTBOUND_MAX_RETRY_AFTER_SEC: int = _get_env_int("OUTBOUND_MAX_RETRY_AFTER_SEC", 30)
+# Общий бюджет правок анимации лоадеров (правок в секунду на весь бот; финальные тексты не ограничиваются)
+LOADER_EDIT_RATE: float = _get_env_float("LOADER_EDIT_RATE", 5.0)
+
+# Максимальный размер скачиваемого из Telegram файла (Bot API отдаёт файлы до 20 МБ)
+MEDIA_MAX_DOWNLOAD_BYTES: int = _get_env_int("MEDIA_MAX_DOWNLOAD_BYTES", 20 * 1024 * 1024)
+# Сколько фото параллельно скачивать при «🔁 Обновить локальные фото»
+PHOTO_BACKFILL_CONCURRENCY: int = _get_env_int("PHOTO_BACKFILL_CONCURRENCY", 5)
+
+# Очистка media/photos от файлов, на которые не ссылается ни один отзыв
+MEDIA_GC_INTERVAL_SEC: int = _get_env_int("MEDIA_GC_INTERVAL_SEC", 6 * 60 * 60)
+# Файлы моложе этого возраста не трогаем: отзыв с ними может ещё сохраняться в БД
+MEDIA_GC_GRACE_SEC: int = _get_env_int("MEDIA_GC_GRACE_SEC", 24 * 60 * 60)
+
+# Как часто сверять счётчики review_stats с таблицей reviews (страховка от расхождений)
+REVIEW_STATS_RECONCILE_INTERVAL_SEC: int = _get_env_int("REVIEW_STATS_RECONCILE_INTERVAL_SEC", 24 * 60 * 60)
+
+# Запись активности пользователей пачками: раз в столько миллисекунд или по стольким событиям
+ACTIVITY_FLUSH_INTERVAL_MS: int = _get_env_int("ACTIVITY_FLUSH_INTERVAL_MS", 1000)
+ACTIVITY_FLUSH_MAX_EVENTS: int = _get_env_int("ACTIVITY_FLUSH_MAX_EVENTS", 500)
+
+# Обслуживание user_activity (партиции по месяцам и дневные итоги в user_activity_daily)
+ACTIVITY_MAINTENANCE_INTERVAL_SEC: int = _get_env_int("ACTIVITY_MAINTENANCE_INTERVAL_SEC", 60 * 60)
+# Сколько месяцев хранить подробные события; более старые партиции удаляются (0 — хранить всё)
+ACTIVITY_RETENTION_MONTHS: int = _get_env_int("ACTIVITY_RETENTION_MONTHS", 6)
+
+# Повторный /start того же пользователя с теми же данными в течение этого времени не пишет в БД
+USER_SEEN_CACHE_TTL_SEC: int = _get_env_int("USER_SEEN_CACHE_TTL_SEC", 60)
+
+# Где хранить состояния FSM: memory (в памяти процесса), postgres (таблица fsm_storage) или redis
+FSM_STORAGE: str = (os.getenv("FSM_STORAGE") or "memory").strip().lower()
+# Адрес сервера с протоколом Redis для FSM_STORAGE=redis, например redis://localhost:6379/0
+FSM_REDIS_URL: str | None = os.getenv("FSM_REDIS_URL")
+# Сколько живёт незавершённый сценарий (отзыв, рассылка) после последнего действия пользователя
+FSM_STATE_TTL_SEC: int = _get_env_int("FSM_STATE_TTL_SEC", 24 * 60 * 60)
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE: str = (os.getenv("BOT_MODE") or "polling").strip().lower()
+# Вебхук: публичный адрес сервиса (https://...), путь и секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_BASE_URL: str | None = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH") or "/webhook"
+WEBHOOK_SECRET: str | None = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+# Render передаёт порт веб-сервиса в PORT
+WEBHOOK_PORT: int = _get_env_int("WEBHOOK_PORT", _get_env_int("PORT", 8080))
+# Сколько обновлений разных чатов обрабатывается параллельно и сколько всего может ждать в очередях
+WEBHOOK_WORKERS: int = _get_env_int("WEBHOOK_WORKERS", 32)
+WEBHOOK_QUEUE_SIZE: int = _get_env_int("WEBHOOK_QUEUE_SIZE", 1000)
+
+if BOT_MODE not in ("polling", "webhook"):
+	raise RuntimeError(f"BOT_MODE must be polling or webhook, got {BOT_MODE!r}")
+if BOT_MODE == "webhook" and not (WEBHOOK_BASE_URL and WEBHOOK_SECRET):
+	raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_BASE_URL and WEBHOOK_SECRET")
+
+# Несколько процессов бота: сколько их всего и номер этого (0..WORKER_COUNT-1). При WORKER_COUNT > 1
+# обновления идут через общую очередь в Postgres, чат закреплён за шардом chat_id % UPDATE_SHARDS
+WORKER_COUNT: int = _get_env_int("WORKER_COUNT", 1)
+WORKER_INDEX: int = _get_env_int("WORKER_INDEX", 0)
+UPDATE_SHARDS: int = _get_env_int("UPDATE_SHARDS", 64)
+# Адрес своего сервера Bot API вместо https://api.telegram.org (локальный сервер или bench/fake_telegram.py)
+TELEGRAM_API_URL: str | None = os.getenv("TELEGRAM_API_URL")
+
+if not 0 <= WORKER_INDEX < WORKER_COUNT:
+	raise RuntimeError(f"WORKER_INDEX must be in 0..{WORKER_COUNT - 1}, got {WORKER_INDEX}")
+if UPDATE_SHARDS < WORKER_COUNT:
+	raise RuntimeError("UPDATE_SHARDS must be at least WORKER_COUNT")
+
+# Метрики Prometheus: GET /metrics на METRICS_HOST:METRICS_PORT (+ WORKER_INDEX при нескольких воркерах), 0 — выключено
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = _get_env_int("METRICS_PORT", 9100)
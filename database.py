@@ -1,341 +1,930 @@
-# --- УДАЛЕНИЕ ОТЗЫВА ---
-async def delete_review(review_id):
-    conn = await get_connection()
-    await conn.execute("DELETE FROM reviews WHERE id = $1", review_id)
-    await conn.close()
 # telegram_reviews_bot/database.py
 
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
 import asyncpg
-from config import DATABASE_URL
+from config import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT, USER_SEEN_CACHE_TTL_SEC
+from migrations import apply_migrations
+from utils import metrics
+
+# Общий пул соединений процесса. Создаётся в init_db(), закрывается в close_db().
+_pool: asyncpg.Pool | None = None
+# Есть ли триграммные индексы для поиска пользователей (migrations/0006); иначе ищем по началу имени
+_user_search_trigram = False
 
 async def get_connection():
+    """Отдельное соединение в обход пула (для разовых скриптов вроде delete_all_reviews.py)."""
     return await asyncpg.connect(DATABASE_URL)
 
+@asynccontextmanager
+async def acquire():
+    """Берёт соединение из пула. Использовать как `async with acquire() as conn:`."""
+    if _pool is None:
+        raise RuntimeError("Пул соединений не инициализирован: сначала вызовите init_db()")
+    started = time.perf_counter()
+    async with _pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+        metrics.db_pool_wait.observe(time.perf_counter() - started)
+        yield conn
+
+def _pool_stats():
+    if _pool is None:
+        return {}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {"busy": size - idle, "idle": idle, "max": _pool.get_max_size()}
+
+metrics.Callback("db_pool_connections", "Connections in the pool, by state.", "gauge", ("state",), _pool_stats)
+
+async def _init_connection(conn):
+    # Время каждого запроса — в метрики (utils/metrics.py)
+    conn.add_query_logger(metrics.observe_db_query)
+
+# Ключи pg_advisory_lock для задач, которые при нескольких воркерах должен выполнять только один
+# (ключ миграций — migrations.MIGRATIONS_LOCK_ID)
+LOCK_BROADCASTS = 7_241_010
+LOCK_PHOTO_BACKFILL = 7_241_011
+LOCK_UPDATE_POLLING = 7_241_020
+# Шард очереди обновлений N блокируется ключом LOCK_UPDATE_SHARD_BASE + N
+LOCK_UPDATE_SHARD_BASE = 7_242_000
+# Канал LISTEN/NOTIFY о новых строках в update_queue
+UPDATE_QUEUE_CHANNEL = "update_queue"
+
+@asynccontextmanager
+async def try_advisory_lock(key):
+    """Пробует взять pg_advisory_lock(key), не дожидаясь. Отдаёт True/False; блокировка держится до выхода из блока.
+
+    Соединение остаётся занятым на всё время блока (сессионная блокировка привязана к нему).
+    """
+    async with acquire() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+        try:
+            yield locked
+        finally:
+            if locked:
+                await conn.execute("SELECT pg_advisory_unlock($1)", key)
+
+async def claim_periodic_job(name, interval_sec):
+    """Отметить запуск периодической задачи, если с прошлого прошло не меньше interval_sec.
+
+    Возвращает True, если запускать должен этот процесс. Одна строка на задачу и ON CONFLICT
+    гарантируют, что из нескольких воркеров интервал займёт только один.
+    """
+    async with acquire() as conn:
+        return await conn.fetchval(
+            """
+            INSERT INTO periodic_jobs (name, last_run) VALUES ($1, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET last_run = CURRENT_TIMESTAMP
+            WHERE periodic_jobs.last_run <= CURRENT_TIMESTAMP - make_interval(secs => $2)
+            RETURNING TRUE
+            """,
+            name, float(interval_sec)
+        ) or False
+
+async def close_db():
+    """Закрывает пул соединений (вызывается при остановке бота)."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
 async def init_db():
-    conn = await get_connection()
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS reviews (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            username TEXT,
-            text TEXT NOT NULL,
-            photo_id TEXT,
-            photo_path TEXT,
-            rating INTEGER DEFAULT 5,
-            status TEXT NOT NULL DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT TRUE
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS message_templates (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            text TEXT NOT NULL
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_activity (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            action TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-    
-    # Добавляем колонки в существующие таблицы, если их нет
-    try:
-        await conn.execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        await conn.execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS rating INTEGER DEFAULT 5")
-        await conn.execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS photo_path TEXT")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE")
-    except:
-        pass
-    
-    await conn.close()
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            init=_init_connection,
+        )
+
+    # Схема создаётся и обновляется миграциями из папки migrations/
+    global _user_search_trigram
+    async with acquire() as conn:
+        await apply_migrations(conn)
+        _user_search_trigram = await conn.fetchval("SELECT to_regclass('idx_users_username_trgm') IS NOT NULL")
 
 # --- USERS ---
+# Недавно записанные пользователи: user_id -> ((username, first_name, last_name), когда записан).
+# Повторный /start с теми же данными в течение USER_SEEN_CACHE_TTL_SEC не пишет в БД.
+_recent_users: OrderedDict[int, tuple[tuple, float]] = OrderedDict()
+_RECENT_USERS_MAX = 10_000
+
 async def add_or_update_user(user_id, username, first_name, last_name):
-    conn = await get_connection()
-    # Проверяем, новый ли это пользователь
-    existing = await conn.fetchval("SELECT user_id FROM users WHERE user_id = $1", user_id)
-    is_new_user = existing is None
-    
-    await conn.execute(
-        """
-        INSERT INTO users (user_id, username, first_name, last_name, last_activity)
-        VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
-        ON CONFLICT (user_id) DO UPDATE SET 
-            username=EXCLUDED.username, 
-            first_name=EXCLUDED.first_name, 
-            last_name=EXCLUDED.last_name,
-            last_activity=CURRENT_TIMESTAMP,
-            is_active=TRUE
-        """,
-        user_id, username, first_name, last_name
-    )
-    
-    # Логируем активность
-    if is_new_user:
-        await conn.execute(
-            "INSERT INTO user_activity (user_id, action) VALUES ($1, $2)",
-            user_id, "user_joined"
-        )
-    else:
-        await conn.execute(
-            "INSERT INTO user_activity (user_id, action) VALUES ($1, $2)",
-            user_id, "user_activity"
-        )
-    
-    await conn.close()
+    """Создать или обновить пользователя. Возвращает True, если пользователь новый.
+
+    Событие активности (user_joined / user_activity) пишет вызывающий код через utils.activity.
+    """
+    profile = (username, first_name, last_name)
+    now = time.monotonic()
+    cached = _recent_users.get(user_id)
+    if cached is not None and cached[0] == profile and now - cached[1] < USER_SEEN_CACHE_TTL_SEC:
+        return False
 
-async def get_all_users(page=1, limit=10, search_query=None):
-    offset = (page - 1) * limit
-    conn = await get_connection()
-    if search_query:
-        users = await conn.fetch(
+    async with acquire() as conn:
+        # xmax = 0 только у только что вставленной строки; при ON CONFLICT DO UPDATE он не нулевой
+        is_new_user = await conn.fetchval(
             """
-            SELECT user_id, username, first_name FROM users
-            WHERE username ILIKE $1 OR first_name ILIKE $1
-            LIMIT $2 OFFSET $3
+            INSERT INTO users (user_id, username, first_name, last_name, last_activity)
+            VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username=EXCLUDED.username,
+                first_name=EXCLUDED.first_name,
+                last_name=EXCLUDED.last_name,
+                last_activity=CURRENT_TIMESTAMP,
+                is_active=TRUE
+            RETURNING (xmax = 0)
             """,
-            f"%{search_query}%", limit, offset
+            user_id, username, first_name, last_name
         )
-        total = await conn.fetchval(
-            "SELECT COUNT(*) FROM users WHERE username ILIKE $1 OR first_name ILIKE $1",
-            f"%{search_query}%"
+
+    _recent_users[user_id] = (profile, now)
+    _recent_users.move_to_end(user_id)
+    if len(_recent_users) > _RECENT_USERS_MAX:
+        _recent_users.popitem(last=False)
+    return is_new_user
+
+class UsersPage(NamedTuple):
+    """Страница списка пользователей в админке."""
+    users: list              # строки user_id/username/first_name по возрастанию user_id
+    total: int               # всего пользователей (подходящих под поиск)
+    has_next: bool
+    prev_cursor: int | None  # курсор предыдущей страницы (0 — первая страница, None — назад некуда)
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _user_search_condition(search_query, param):
+    """Условие поиска пользователей по username/first_name с шаблоном в параметре $param."""
+    if not search_query:
+        return "TRUE", []
+    if _user_search_trigram:
+        return f"(username ILIKE ${param} OR first_name ILIKE ${param})", [f"%{_escape_like(search_query)}%"]
+    return (
+        f"(lower(username) LIKE ${param} OR lower(first_name) LIKE ${param})",
+        [f"{_escape_like(search_query.lower())}%"],
+    )
+
+# Число пользователей для списка в админке: поиск -> (количество, когда посчитано).
+# Подсчёт читает всех подходящих пользователей, поэтому при листании он не повторяется.
+_users_total_cache: OrderedDict[str, tuple[int, float]] = OrderedDict()
+_USERS_TOTAL_CACHE_MAX = 256
+USERS_TOTAL_CACHE_TTL_SEC = 60
+
+async def count_users(search_query=None):
+    """Сколько пользователей подходит под поиск (без поиска — всего). Кэшируется на USERS_TOTAL_CACHE_TTL_SEC."""
+    key = search_query or ""
+    now = time.monotonic()
+    cached = _users_total_cache.get(key)
+    if cached is not None and now - cached[1] < USERS_TOTAL_CACHE_TTL_SEC:
+        return cached[0]
+
+    condition, params = _user_search_condition(search_query, 1)
+    async with acquire() as conn:
+        total = await conn.fetchval(f"SELECT COUNT(*) FROM users WHERE {condition}", *params)
+
+    _users_total_cache[key] = (total, now)
+    _users_total_cache.move_to_end(key)
+    if len(_users_total_cache) > _USERS_TOTAL_CACHE_MAX:
+        _users_total_cache.popitem(last=False)
+    return total
+
+async def get_users_page(cursor=0, limit=10, search_query=None):
+    """Страница пользователей с user_id > cursor и общее количество.
+
+    Страница и курсор предыдущей страницы берутся одним запросом с LIMIT прямо по индексу user_id,
+    общее количество — из count_users() (отдельный подсчёт, кэшируется на время листания).
+    Поиск по username/first_name идёт по триграммным индексам (подстрока, без учёта регистра),
+    а без pg_trgm — по индексам lower(...) text_pattern_ops (начало строки).
+    """
+    condition, params = _user_search_condition(search_query, 3)
+
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            WITH page AS (
+                SELECT user_id, username, first_name FROM users
+                WHERE user_id > $2 AND {condition} ORDER BY user_id LIMIT $1 + 1
+            ), older AS (
+                SELECT user_id FROM users
+                WHERE user_id <= $2 AND {condition} ORDER BY user_id DESC LIMIT $1 + 1
+            )
+            SELECT (SELECT COUNT(*) FROM older) AS older_count,
+                   (SELECT user_id FROM older ORDER BY user_id DESC OFFSET $1 LIMIT 1) AS prev_after_id,
+                   page.user_id, page.username, page.first_name
+            FROM (SELECT 1) AS head LEFT JOIN page ON TRUE
+            ORDER BY page.user_id
+            """,
+            limit, cursor, *params
         )
+    head = rows[0]
+    users = [row for row in rows if row['user_id'] is not None]
+
+    # Предыдущая страница — `limit` пользователей до курсора; её курсор — user_id перед ними (или 0)
+    if not cursor or head['older_count'] == 0:
+        prev_cursor = None
+    elif head['older_count'] > limit:
+        prev_cursor = head['prev_after_id']
     else:
-        users = await conn.fetch(
-            "SELECT user_id, username, first_name FROM users LIMIT $1 OFFSET $2",
-            limit, offset
-        )
-        total = await conn.fetchval("SELECT COUNT(*) FROM users")
-    await conn.close()
-    return users, total
+        prev_cursor = 0
+
+    return UsersPage(
+        users=users[:limit],
+        total=await count_users(search_query),
+        has_next=len(users) > limit,
+        prev_cursor=prev_cursor,
+    )
 
 async def get_all_user_ids():
-    conn = await get_connection()
-    rows = await conn.fetch("SELECT user_id FROM users")
-    await conn.close()
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT user_id FROM users")
     return [row["user_id"] for row in rows]
 
 async def get_active_user_ids():
-    conn = await get_connection()
-    rows = await conn.fetch("SELECT user_id FROM users WHERE is_active = TRUE")
-    await conn.close()
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT user_id FROM users WHERE is_active = TRUE")
     return [row["user_id"] for row in rows]
 
 async def set_user_active(user_id: int, is_active: bool) -> None:
-    conn = await get_connection()
-    await conn.execute(
-        "UPDATE users SET is_active = $1 WHERE user_id = $2",
-        is_active,
-        user_id,
-    )
-    await conn.close()
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE users SET is_active = $1 WHERE user_id = $2",
+            is_active,
+            user_id,
+        )
 
 # --- REVIEWS ---
 async def add_review(user_id, username, text, photo_id=None, photo_path=None, rating=5):
-    conn = await get_connection()
-    row = await conn.fetchrow(
-        """
-        INSERT INTO reviews (user_id, username, text, photo_id, photo_path, rating)
-        VALUES ($1, $2, $3, $4, $5, $6)
-        RETURNING id
-        """,
-        user_id, username, text, photo_id, photo_path, rating
-    )
-    await conn.close()
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO reviews (user_id, username, text, photo_id, photo_path, rating)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id
+            """,
+            user_id, username, text, photo_id, photo_path, rating
+        )
     return row["id"]
 
 async def get_review(review_id):
-    conn = await get_connection()
-    row = await conn.fetchrow("SELECT * FROM reviews WHERE id = $1", review_id)
-    await conn.close()
-    return row
+    async with acquire() as conn:
+        return await conn.fetchrow("SELECT * FROM reviews WHERE id = $1", review_id)
+
+async def get_review_with_cached_photo(review_id, bot_id):
+    """Отзыв вместе с file_id фото, который уже загружал этот бот (колонка cached_file_id, может быть NULL)."""
+    async with acquire() as conn:
+        return await conn.fetchrow(
+            """
+            SELECT r.*, c.file_id AS cached_file_id
+            FROM reviews r
+            LEFT JOIN review_photo_cache c ON c.review_id = r.id AND c.bot_id = $2
+            WHERE r.id = $1
+            """,
+            review_id, bot_id
+        )
+
+async def cache_review_photo_file_id(review_id, bot_id, file_id):
+    """Запоминает file_id, который Telegram вернул после загрузки локального фото этим ботом."""
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO review_photo_cache (review_id, bot_id, file_id)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (review_id, bot_id) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = CURRENT_TIMESTAMP
+            """,
+            review_id, bot_id, file_id
+        )
+
+async def drop_cached_review_photo(review_id, bot_id):
+    """Забывает закэшированный file_id, который Telegram больше не принимает."""
+    async with acquire() as conn:
+        await conn.execute(
+            "DELETE FROM review_photo_cache WHERE review_id = $1 AND bot_id = $2",
+            review_id, bot_id
+        )
 
 async def update_review_status(review_id, status):
-    conn = await get_connection()
-    await conn.execute("UPDATE reviews SET status = $1 WHERE id = $2", status, review_id)
-    await conn.close()
+    async with acquire() as conn:
+        await conn.execute("UPDATE reviews SET status = $1 WHERE id = $2", status, review_id)
+
+# --- УДАЛЕНИЕ ОТЗЫВА ---
+async def delete_review(review_id):
+    """Удаляет отзыв. Возвращает его photo_path, чтобы можно было освободить файл."""
+    async with acquire() as conn:
+        return await conn.fetchval("DELETE FROM reviews WHERE id = $1 RETURNING photo_path", review_id)
 
 async def get_approved_reviews(offset=0, limit=5):
-    conn = await get_connection()
-    rows = await conn.fetch(
-        "SELECT * FROM reviews WHERE status = 'approved' ORDER BY id DESC LIMIT $1 OFFSET $2",
-        limit, offset
-    )
-    await conn.close()
-    return rows
-
-async def get_reviews_missing_photo_path(limit=100):
-    """Возвращает список отзывов, у которых есть photo_id, но нет photo_path (нужно попытаться скачать)."""
-    conn = await get_connection()
-    rows = await conn.fetch(
-        "SELECT * FROM reviews WHERE photo_id IS NOT NULL AND (photo_path IS NULL OR photo_path = '') LIMIT $1",
-        limit,
-    )
-    await conn.close()
-    return rows
+    async with acquire() as conn:
+        return await conn.fetch(
+            "SELECT * FROM reviews WHERE status = 'approved' ORDER BY id DESC LIMIT $1 OFFSET $2",
+            limit, offset
+        )
 
-async def update_review_photo_path(review_id, photo_path):
-    conn = await get_connection()
-    await conn.execute(
-        "UPDATE reviews SET photo_path = $1 WHERE id = $2",
-        photo_path,
-        review_id,
+class ReviewPage(NamedTuple):
+    """Страница списка отзывов для show_reviews_page."""
+    reviews: list        # строки id/username/photo_id (с full — ещё rating/text), новые сверху
+    total: int           # всего одобренных отзывов
+    avg_rating: float    # средняя оценка одобренных (0.0, если оценок нет)
+    has_next: bool       # есть ли отзывы старше последнего на странице
+    prev_cursor: int | None  # курсор предыдущей страницы (0 — первая страница, None — назад некуда)
+
+# Курсор страницы — id, строго меньше которого берутся отзывы; 0 означает «с самого начала».
+_CURSOR_TOP = 2**31 - 1
+
+async def get_review_page(cursor=0, limit=5, full=False):
+    """Страница списка отзывов (keyset-пагинация) за один запрос к БД.
+
+    Берёт `limit` одобренных отзывов с id < cursor по частичному индексу idx_reviews_approved_id,
+    поэтому время ответа не зависит от глубины страницы. full — вместе с оценкой и текстом отзывов.
+    """
+    before = cursor or _CURSOR_TOP
+    columns = "id, username, photo_id, rating, text" if full else "id, username, photo_id"
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            WITH page AS (
+                SELECT {columns} FROM reviews
+                WHERE status = 'approved' AND id < $2
+                ORDER BY id DESC LIMIT $1 + 1
+            ), newer AS (
+                SELECT id FROM reviews
+                WHERE status = 'approved' AND id >= $2
+                ORDER BY id ASC LIMIT $1 + 1
+            ), totals AS (
+                SELECT
+                    COALESCE(SUM(review_count), 0)::BIGINT AS total,
+                    (SUM(rating_sum)::NUMERIC / NULLIF(SUM(review_count) FILTER (WHERE rating > 0), 0))::NUMERIC(3,1) AS avg_rating
+                FROM review_stats WHERE status = 'approved'
+            )
+            SELECT totals.total, totals.avg_rating,
+                   (SELECT COUNT(*) FROM newer) AS newer_count,
+                   (SELECT id FROM newer ORDER BY id ASC OFFSET $1 - 1 LIMIT 1) AS prev_last_id,
+                   page.*
+            FROM totals LEFT JOIN page ON TRUE
+            ORDER BY page.id DESC
+            """,
+            limit, before
+        )
+    # totals всегда даёт ровно одну строку, даже если страница пустая
+    head = rows[0]
+    avg_rating = float(head['avg_rating']) if head['avg_rating'] else 0.0
+    reviews = [row for row in rows if row['id'] is not None]
+
+    # Предыдущая страница — `limit` ближайших более новых отзывов.
+    # Если над ними есть ещё отзывы, её курсор — id самого нового из них + 1, иначе это первая страница.
+    if not cursor or head['newer_count'] == 0:
+        prev_cursor = None
+    elif head['newer_count'] > limit:
+        prev_cursor = head['prev_last_id'] + 1
+    else:
+        prev_cursor = 0
+
+    return ReviewPage(
+        reviews=reviews[:limit],
+        total=head['total'],
+        avg_rating=avg_rating,
+        has_next=len(reviews) > limit,
+        prev_cursor=prev_cursor,
     )
-    await conn.close()
 
-async def update_review_photo(review_id, photo_id, photo_path=None):
-    conn = await get_connection()
-    if photo_path:
+async def get_reviews_missing_photo_path(limit=100, after_id=0):
+    """Возвращает список отзывов, у которых есть photo_id, но нет photo_path (нужно попытаться скачать).
+
+    Отзывы идут по возрастанию id начиная после after_id, чтобы большой хвост можно было пройти пачками.
+    """
+    async with acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT id, user_id, photo_id FROM reviews
+            WHERE photo_id IS NOT NULL AND (photo_path IS NULL OR photo_path = '') AND id > $2
+            ORDER BY id
+            LIMIT $1
+            """,
+            limit, after_id,
+        )
+
+async def update_review_photo_path(review_id, photo_path):
+    async with acquire() as conn:
         await conn.execute(
-            "UPDATE reviews SET photo_id = $1, photo_path = $2 WHERE id = $3",
-            photo_id,
+            "UPDATE reviews SET photo_path = $1 WHERE id = $2",
             photo_path,
             review_id,
         )
-    else:
+
+async def update_review_photo_paths(paths: dict[int, str]):
+    """Проставляет photo_path сразу нескольким отзывам одним UPDATE ({review_id: photo_path})."""
+    if not paths:
+        return
+    async with acquire() as conn:
         await conn.execute(
-            "UPDATE reviews SET photo_id = $1 WHERE id = $2",
-            photo_id,
-            review_id,
+            """
+            UPDATE reviews AS r SET photo_path = v.photo_path
+            FROM unnest($1::int[], $2::text[]) AS v(id, photo_path)
+            WHERE r.id = v.id
+            """,
+            list(paths.keys()), list(paths.values()),
+        )
+
+async def update_review_photo(review_id, photo_id, photo_path=None):
+    """Заменяет фото отзыва. Возвращает прежний photo_path (если его заменили), чтобы можно было освободить файл."""
+    async with acquire() as conn:
+        async with conn.transaction():
+            old_path = await conn.fetchval("SELECT photo_path FROM reviews WHERE id = $1 FOR UPDATE", review_id)
+            # Фото заменили — закэшированные file_id старой картинки больше не подходят
+            await conn.execute("DELETE FROM review_photo_cache WHERE review_id = $1", review_id)
+            if photo_path:
+                await conn.execute(
+                    "UPDATE reviews SET photo_id = $1, photo_path = $2 WHERE id = $3",
+                    photo_id,
+                    photo_path,
+                    review_id,
+                )
+            else:
+                await conn.execute(
+                    "UPDATE reviews SET photo_id = $1 WHERE id = $2",
+                    photo_id,
+                    review_id,
+                )
+    return old_path if photo_path and old_path != photo_path else None
+
+async def count_reviews_with_photo_path(photo_path):
+    """Сколько отзывов ссылается на файл (счётчик ссылок для хранилища фото)."""
+    async with acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM reviews WHERE photo_path = $1", photo_path)
+
+async def get_all_photo_paths():
+    """Все пути к фото, на которые ссылаются отзывы (для очистки хранилища)."""
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT DISTINCT photo_path FROM reviews WHERE photo_path IS NOT NULL AND photo_path <> ''"
         )
-    await conn.close()
+    return [row["photo_path"] for row in rows]
 
 async def count_approved_reviews():
-    conn = await get_connection()
-    count = await conn.fetchval("SELECT COUNT(*) FROM reviews WHERE status = 'approved'")
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COALESCE(SUM(review_count), 0)::BIGINT FROM review_stats WHERE status = 'approved'"
+        )
 
 # --- TEMPLATES ---
 async def add_template(name, text):
-    conn = await get_connection()
-    await conn.execute(
-        """
-        INSERT INTO message_templates (name, text)
-        VALUES ($1, $2)
-        ON CONFLICT (name) DO UPDATE SET text=EXCLUDED.text
-        """,
-        name, text
-    )
-    await conn.close()
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO message_templates (name, text)
+            VALUES ($1, $2)
+            ON CONFLICT (name) DO UPDATE SET text=EXCLUDED.text
+            """,
+            name, text
+        )
 
 async def get_template(name):
-    conn = await get_connection()
-    row = await conn.fetchrow("SELECT * FROM message_templates WHERE name = $1", name)
-    await conn.close()
-    return row
+    async with acquire() as conn:
+        return await conn.fetchrow("SELECT * FROM message_templates WHERE name = $1", name)
 
 async def get_all_templates():
-    conn = await get_connection()
-    rows = await conn.fetch("SELECT name FROM message_templates")
-    await conn.close()
-    return rows
+    async with acquire() as conn:
+        return await conn.fetch("SELECT name FROM message_templates")
+
+# --- РАССЫЛКИ ---
+# Рассылка хранится в broadcast_jobs; получатели — активные пользователи по возрастанию user_id.
+# Воркер отправляет их пачками и после каждой пачки сохраняет last_user_id,
+# поэтому после перезапуска рассылка продолжается с места остановки.
+async def create_broadcast_job(kind, text, reply_markup=None, disable_notification=False):
+    """Создаёт задание на рассылку всем активным пользователям. Возвращает id задания."""
+    async with acquire() as conn:
+        return await conn.fetchval(
+            """
+            INSERT INTO broadcast_jobs (kind, text, reply_markup, disable_notification, total)
+            VALUES ($1, $2, $3, $4, (SELECT COUNT(*) FROM users WHERE is_active = TRUE))
+            RETURNING id
+            """,
+            kind, text, reply_markup, disable_notification
+        )
+
+async def get_broadcast_job(job_id):
+    async with acquire() as conn:
+        return await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id = $1", job_id)
+
+async def get_next_broadcast_job():
+    """Самое старое незавершённое задание (в том числе прерванное перезапуском)."""
+    async with acquire() as conn:
+        return await conn.fetchrow(
+            "SELECT * FROM broadcast_jobs WHERE status IN ('pending', 'running') ORDER BY id LIMIT 1"
+        )
+
+async def start_broadcast_job(job_id):
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE broadcast_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = $1",
+            job_id,
+        )
+
+async def get_broadcast_recipients(after_user_id, limit=100):
+    """Следующая пачка получателей после контрольной точки задания."""
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT user_id FROM users WHERE is_active = TRUE AND user_id > $1 ORDER BY user_id LIMIT $2",
+            after_user_id, limit
+        )
+    return [row["user_id"] for row in rows]
+
+async def checkpoint_broadcast_job(job_id, last_user_id, sent_ids, failed_ids, inactive_ids):
+    """Сохраняет результат пачки одной транзакцией: доставки, счётчики, контрольная точка и неактивные пользователи."""
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO broadcast_deliveries (job_id, user_id, status)
+                SELECT $1, user_id, 'sent' FROM unnest($2::bigint[]) AS user_id
+                UNION ALL
+                SELECT $1, user_id, 'failed' FROM unnest($3::bigint[]) AS user_id
+                ON CONFLICT (job_id, user_id) DO NOTHING
+                """,
+                job_id, sent_ids, failed_ids
+            )
+            await conn.execute(
+                """
+                UPDATE broadcast_jobs
+                SET sent = sent + $2, failed = failed + $3, attempts = 0,
+                    last_user_id = GREATEST(last_user_id, $4), updated_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+                """,
+                job_id, len(sent_ids), len(failed_ids), last_user_id
+            )
+            if inactive_ids:
+                await conn.execute(
+                    "UPDATE users SET is_active = FALSE WHERE user_id = ANY($1::bigint[])",
+                    inactive_ids,
+                )
+    # Следующий /start этих пользователей должен снова записать is_active = TRUE
+    for user_id in inactive_ids:
+        _recent_users.pop(user_id, None)
+
+async def record_broadcast_job_error(job_id, error):
+    """Запоминает ошибку задания. Возвращает, сколько раз подряд оно падало (успешная пачка сбрасывает счётчик)."""
+    async with acquire() as conn:
+        return await conn.fetchval(
+            """
+            UPDATE broadcast_jobs
+            SET attempts = attempts + 1, last_error = $2, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            RETURNING attempts
+            """,
+            job_id, error
+        )
+
+async def finish_broadcast_job(job_id, status='done'):
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE broadcast_jobs
+            SET status = $2, updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            """,
+            job_id, status
+        )
 
 # --- СТАТИСТИКА ---
+class StatsSnapshot(NamedTuple):
+    """Все цифры для экрана «📊 Статистика»."""
+    total_users: int
+    daily_new_users: int
+    active_today: int
+    inactive_users: int
+    total_reviews: int
+    approved_reviews: int
+    daily_reviews: int
+    avg_rating: float
+    reviews_by_status: dict[str, int]
+    rating_distribution: dict[int, int]
+
+async def get_stats_snapshot() -> StatsSnapshot:
+    """Статистика для админки одним запросом (вместо десяти отдельных get_*)."""
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            WITH u AS (
+                SELECT
+                    (SELECT COUNT(*) FROM users) AS total_users,
+                    (SELECT COUNT(*) FROM users
+                     WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + INTERVAL '1 day') AS daily_new_users,
+                    (SELECT COUNT(*) FROM users
+                     WHERE last_activity >= CURRENT_DATE AND last_activity < CURRENT_DATE + INTERVAL '1 day') AS active_today,
+                    (SELECT COUNT(*) FROM users
+                     WHERE last_activity < CURRENT_DATE - INTERVAL '7 days') AS inactive_users
+            ), r AS (
+                SELECT
+                    COALESCE(SUM(review_count), 0)::BIGINT AS total_reviews,
+                    COALESCE(SUM(review_count) FILTER (WHERE status = 'approved'), 0)::BIGINT AS approved_reviews,
+                    (SUM(rating_sum) FILTER (WHERE status = 'approved')::NUMERIC
+                        / NULLIF(SUM(review_count) FILTER (WHERE status = 'approved' AND rating > 0), 0))::NUMERIC(3,1) AS avg_rating
+                FROM review_stats
+            ), daily AS (
+                SELECT COUNT(*) AS daily_reviews FROM reviews
+                WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + INTERVAL '1 day'
+            ), by_status AS (
+                SELECT array_agg(status ORDER BY status) AS statuses, array_agg(cnt ORDER BY status) AS status_counts
+                FROM (
+                    SELECT status, SUM(review_count)::BIGINT AS cnt FROM review_stats
+                    GROUP BY status HAVING SUM(review_count) > 0
+                ) s
+            ), by_rating AS (
+                SELECT array_agg(rating ORDER BY rating) AS ratings, array_agg(review_count ORDER BY rating) AS rating_counts
+                FROM review_stats WHERE status = 'approved' AND rating > 0 AND review_count > 0
+            )
+            SELECT * FROM u, r, daily, by_status, by_rating
+            """
+        )
+    return StatsSnapshot(
+        total_users=row['total_users'],
+        daily_new_users=row['daily_new_users'],
+        active_today=row['active_today'],
+        inactive_users=row['inactive_users'],
+        total_reviews=row['total_reviews'],
+        approved_reviews=row['approved_reviews'],
+        daily_reviews=row['daily_reviews'],
+        avg_rating=float(row['avg_rating']) if row['avg_rating'] else 0.0,
+        reviews_by_status=dict(zip(row['statuses'] or [], row['status_counts'] or [])),
+        rating_distribution=dict(zip(row['ratings'] or [], row['rating_counts'] or [])),
+    )
+
 async def get_total_users_count():
     """Получить общее количество пользователей."""
-    conn = await get_connection()
-    count = await conn.fetchval("SELECT COUNT(*) FROM users")
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM users")
 
 async def get_total_reviews_count():
     """Получить общее количество отзывов."""
-    conn = await get_connection()
-    count = await conn.fetchval("SELECT COUNT(*) FROM reviews")
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval("SELECT COALESCE(SUM(review_count), 0)::BIGINT FROM review_stats")
 
 async def get_daily_new_users():
     """Получить количество новых пользователей за сегодня."""
-    conn = await get_connection()
-    count = await conn.fetchval(
-        "SELECT COUNT(*) FROM users WHERE DATE(created_at) = CURRENT_DATE"
-    )
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM users "
+            "WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + INTERVAL '1 day'"
+        )
 
 async def get_daily_reviews():
     """Получить количество отзывов за сегодня."""
-    conn = await get_connection()
-    count = await conn.fetchval(
-        "SELECT COUNT(*) FROM reviews WHERE DATE(created_at) = CURRENT_DATE"
-    )
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM reviews "
+            "WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + INTERVAL '1 day'"
+        )
 
 async def get_active_users_today():
     """Получить количество активных пользователей сегодня."""
-    conn = await get_connection()
-    count = await conn.fetchval(
-        "SELECT COUNT(*) FROM users WHERE DATE(last_activity) = CURRENT_DATE"
-    )
-    await conn.close()
-    return count
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM users "
+            "WHERE last_activity >= CURRENT_DATE AND last_activity < CURRENT_DATE + INTERVAL '1 day'"
+        )
 
 async def get_inactive_users_count():
     """Получить количество неактивных пользователей (более 7 дней без активности)."""
-    conn = await get_connection()
-    count = await conn.fetchval(
-        "SELECT COUNT(*) FROM users WHERE last_activity < CURRENT_DATE - INTERVAL '7 days'"
-    )
-    await conn.close()
-    return count
-
-async def log_user_activity(user_id, action):
-    """Записать активность пользователя."""
-    conn = await get_connection()
-    await conn.execute(
-        "INSERT INTO user_activity (user_id, action) VALUES ($1, $2)",
-        user_id, action
-    )
-    # Обновляем последнюю активность пользователя
-    await conn.execute(
-        "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = $1",
-        user_id
-    )
-    await conn.close()
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM users WHERE last_activity < CURRENT_DATE - INTERVAL '7 days'"
+        )
+
+async def insert_user_activity_batch(events, last_seen):
+    """Записать пачку событий активности (см. utils/activity.py).
+
+    events — список (user_id, action, сколько секунд назад произошло событие);
+    last_seen — {user_id: сколько секунд назад был последний визит} для users.last_activity.
+    """
+    user_ids, actions, ages = zip(*events)
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO user_activity (user_id, action, created_at)
+                SELECT user_id, action, CURRENT_TIMESTAMP - make_interval(secs => age)
+                FROM unnest($1::BIGINT[], $2::TEXT[], $3::FLOAT8[]) AS t(user_id, action, age)
+                """,
+                list(user_ids), list(actions), list(ages)
+            )
+            await conn.execute(
+                """
+                UPDATE users SET last_activity = GREATEST(users.last_activity, CURRENT_TIMESTAMP - make_interval(secs => t.age))
+                FROM unnest($1::BIGINT[], $2::FLOAT8[]) AS t(user_id, age)
+                WHERE users.user_id = t.user_id
+                """,
+                list(last_seen.keys()), list(last_seen.values())
+            )
+
+class ActivityMaintenanceResult(NamedTuple):
+    rolled_up_rows: int          # сколько строк (день, действие) записано в user_activity_daily
+    dropped_partitions: list[str]
+
+async def maintain_user_activity(retention_months):
+    """Обслуживание партиций user_activity (см. migrations/0005_partition_user_activity.sql).
+
+    Создаёт партиции на текущий и следующий месяц, досчитывает дневные итоги за завершённые дни
+    и удаляет партиции старше retention_months месяцев (0 — ничего не удалять). Партиция удаляется,
+    только если все её дни уже есть в user_activity_daily.
+    """
+    async with acquire() as conn:
+        await conn.execute(
+            "SELECT user_activity_create_partition(CURRENT_DATE), "
+            "user_activity_create_partition((CURRENT_DATE + INTERVAL '1 month')::DATE)"
+        )
+        # Дни считаются завершёнными через час после полуночи: буфер активности пишет события с задержкой
+        status = await conn.execute(
+            """
+            INSERT INTO user_activity_daily (day, action, events, users)
+            SELECT created_at::DATE, action, COUNT(*), COUNT(DISTINCT user_id)
+            FROM user_activity
+            WHERE created_at >= COALESCE((SELECT MAX(day) + 1 FROM user_activity_daily), '-infinity'::DATE)
+              AND created_at < (CURRENT_TIMESTAMP - INTERVAL '1 hour')::DATE
+            GROUP BY created_at::DATE, action
+            ON CONFLICT (day, action) DO UPDATE SET events = EXCLUDED.events, users = EXCLUDED.users
+            """
+        )
+        dropped = []
+        if retention_months > 0:
+            rows = await conn.fetch(
+                """
+                SELECT user_activity_drop_partitions_before(LEAST(
+                    date_trunc('month', CURRENT_DATE - make_interval(months => $1))::DATE,
+                    COALESCE((SELECT MAX(day) + 1 FROM user_activity_daily), '-infinity'::DATE)
+                ))
+                """,
+                retention_months
+            )
+            dropped = [row[0] for row in rows]
+    return ActivityMaintenanceResult(rolled_up_rows=int(status.split()[-1]), dropped_partitions=dropped)
 
 async def get_reviews_by_status():
     """Получить статистику отзывов по статусам."""
-    conn = await get_connection()
-    stats = await conn.fetch(
-        "SELECT status, COUNT(*) as count FROM reviews GROUP BY status"
-    )
-    await conn.close()
+    async with acquire() as conn:
+        stats = await conn.fetch(
+            "SELECT status, SUM(review_count)::BIGINT AS count FROM review_stats GROUP BY status HAVING SUM(review_count) > 0"
+        )
     return {row['status']: row['count'] for row in stats}
 
 async def get_average_rating():
     """Получить среднюю оценку одобренных отзывов."""
-    conn = await get_connection()
-    result = await conn.fetchval(
-        "SELECT AVG(rating)::NUMERIC(3,1) FROM reviews WHERE status = 'approved'"
-    )
-    await conn.close()
+    async with acquire() as conn:
+        result = await conn.fetchval(
+            """
+            SELECT (SUM(rating_sum)::NUMERIC / NULLIF(SUM(review_count) FILTER (WHERE rating > 0), 0))::NUMERIC(3,1)
+            FROM review_stats WHERE status = 'approved'
+            """
+        )
     return float(result) if result else 0.0
 
 async def get_rating_distribution():
     """Получить распределение оценок."""
-    conn = await get_connection()
-    stats = await conn.fetch(
-        "SELECT rating, COUNT(*) as count FROM reviews WHERE status = 'approved' GROUP BY rating ORDER BY rating"
-    )
-    await conn.close()
-    return {row['rating']: row['count'] for row in stats}
\ No newline at end of file
+    async with acquire() as conn:
+        stats = await conn.fetch(
+            """
+            SELECT rating, review_count AS count FROM review_stats
+            WHERE status = 'approved' AND rating > 0 AND review_count > 0
+            ORDER BY rating
+            """
+        )
+    return {row['rating']: row['count'] for row in stats}
+
+async def reconcile_review_stats():
+    """Пересчитывает review_stats по таблице reviews (исправляет расхождения, например после TRUNCATE)."""
+    async with acquire() as conn:
+        async with conn.transaction():
+            # SHARE-блокировка не даёт менять отзывы во время пересчёта, но не мешает их читать
+            await conn.execute("LOCK TABLE reviews IN SHARE MODE")
+            await conn.execute("DELETE FROM review_stats")
+            await conn.execute(
+                """
+                INSERT INTO review_stats (status, rating, review_count, rating_sum)
+                SELECT status, COALESCE(rating, 0), COUNT(*), COALESCE(SUM(rating), 0)
+                FROM reviews GROUP BY status, COALESCE(rating, 0)
+                """
+            )
+
+# --- FSM ---
+# Хранилище состояний aiogram для FSM_STORAGE=postgres (utils/fsm_storage.py).
+# ttl — сколько секунд запись живёт после последнего изменения; просроченная читается как пустая.
+
+async def fsm_get_state(key, ttl):
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT state FROM fsm_storage WHERE key = $1 AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => $2)",
+            key, ttl
+        )
+
+async def fsm_set_state(key, state, ttl):
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO fsm_storage (key, state) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE SET
+                state = EXCLUDED.state,
+                data = CASE WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - make_interval(secs => $3)
+                            THEN fsm_storage.data ELSE '{}'::jsonb END,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            key, state, ttl
+        )
+
+async def fsm_get_data(key, ttl):
+    async with acquire() as conn:
+        data = await conn.fetchval(
+            "SELECT data FROM fsm_storage WHERE key = $1 AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => $2)",
+            key, ttl
+        )
+    return json.loads(data) if data else {}
+
+async def fsm_set_data(key, data, ttl):
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO fsm_storage (key, data) VALUES ($1, $2::jsonb)
+            ON CONFLICT (key) DO UPDATE SET
+                data = EXCLUDED.data,
+                state = CASE WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - make_interval(secs => $3)
+                             THEN fsm_storage.state END,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            key, json.dumps(data), ttl
+        )
+
+async def fsm_update_data(key, data, ttl):
+    """Слить data с текущими данными и вернуть результат — один запрос вместо get_data + set_data."""
+    async with acquire() as conn:
+        merged = await conn.fetchval(
+            """
+            INSERT INTO fsm_storage (key, data) VALUES ($1, $2::jsonb)
+            ON CONFLICT (key) DO UPDATE SET
+                data = CASE WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - make_interval(secs => $3)
+                            THEN fsm_storage.data ELSE '{}'::jsonb END || EXCLUDED.data,
+                state = CASE WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - make_interval(secs => $3)
+                             THEN fsm_storage.state END,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING data
+            """,
+            key, json.dumps(data), ttl
+        )
+    return json.loads(merged)
+
+async def delete_expired_fsm_states(ttl):
+    """Удалить просроченные записи FSM. Возвращает количество удалённых."""
+    async with acquire() as conn:
+        status = await conn.execute(
+            "DELETE FROM fsm_storage WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)",
+            ttl
+        )
+    return int(status.split()[-1])
+
+# --- ОЧЕРЕДЬ ОБНОВЛЕНИЙ (несколько воркеров) ---
+async def enqueue_updates(updates):
+    """Сохранить обновления [(update_id, shard, payload_json)] и разбудить воркеров. Повторы отбрасываются."""
+    update_ids, shards, payloads = zip(*updates)
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO update_queue (update_id, shard, payload)
+                SELECT * FROM unnest($1::BIGINT[], $2::INTEGER[], $3::TEXT[])
+                ON CONFLICT (update_id) DO NOTHING
+                """,
+                list(update_ids), list(shards), list(payloads)
+            )
+            # В уведомлении — затронутые шарды, чтобы будить только их циклы
+            await conn.execute(
+                "SELECT pg_notify($1, $2)", UPDATE_QUEUE_CHANNEL, ",".join(map(str, sorted(set(shards))))
+            )
+
+async def claim_updates(shards, limit, worker_index):
+    """Забрать до limit необработанных обновлений из шардов воркера, по возрастанию update_id.
+
+    Строка помечается claimed_at в том же запросе, поэтому одно обновление достаётся только одному воркеру.
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE update_queue SET claimed_at = CURRENT_TIMESTAMP, claimed_by = $3
+            WHERE update_id IN (
+                SELECT update_id FROM update_queue
+                WHERE claimed_at IS NULL AND shard = ANY($1::INTEGER[])
+                ORDER BY update_id LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING update_id, shard, payload
+            """,
+            shards, limit, worker_index
+        )
+    return sorted(rows, key=lambda row: row['update_id'])
+
+async def purge_claimed_updates(older_than_sec):
+    """Удалить из update_queue обработанные обновления старше older_than_sec. Возвращает количество."""
+    async with acquire() as conn:
+        status = await conn.execute(
+            "DELETE FROM update_queue WHERE claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $1)",
+            float(older_than_sec)
+        )
+    return int(status.split()[-1])
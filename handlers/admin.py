@@ -1,18 +1,18 @@
 # telegram_reviews_bot/handlers/admin.py
 import asyncio
 from aiogram import Router, F, Bot
-import os
-import uuid
-from pathlib import Path
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Filter
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 import database as db
-from config import ADMIN_ID
+from config import ADMIN_ID, PHOTO_BACKFILL_CONCURRENCY
 from utils.loader import loading_statistics, loading_user_data, MailingProgressLoader
-import asyncio
+from utils.activity import activity
+from utils.broadcast import broadcaster
+from utils.outbound import outbound
+from utils import media
+from utils.media import save_telegram_photo, backfill_local_photos, release_photo, get_media_size
 
 # Добавляем 1000 к количеству отзывов для отображения
 REVIEWS_COUNT_OFFSET = 1000
@@ -51,39 +51,43 @@ async def admin_panel(message: Message):
     keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
     await message.answer("Добро пожаловать в админ-панель!", reply_markup=keyboard)
 
+# Фоновая догрузка локальных фото (одна на процесс; между процессами — advisory lock)
+_photo_backfill_task: asyncio.Task | None = None
+
 @router.message(F.text == "🔁 Обновить локальные фото")
 async def refresh_local_photos(message: Message, bot: Bot):
-    """Попытаться скачать и сохранить локальные копии фото для отзывов без photo_path."""
-    msg = await message.answer("🔄 Запуск обновления локальных фото. Пожалуйста, дождитесь результата...")
-    reviews = await db.get_reviews_missing_photo_path(limit=1000)
-    if not reviews:
-        await msg.edit_text("✅ Нет отзывов, требующих сохранения локальных фото.")
+    """Запускает в фоне скачивание локальных копий фото для отзывов без photo_path."""
+    global _photo_backfill_task
+    if _photo_backfill_task and not _photo_backfill_task.done():
+        await message.answer("⏳ Обновление локальных фото уже идёт, прогресс — в предыдущем сообщении.")
         return
 
-    success = 0
-    failed = 0
-    media_dir = Path("media/photos")
-    media_dir.mkdir(parents=True, exist_ok=True)
+    msg = await message.answer("🔄 Запуск обновления локальных фото. Прогресс будет обновляться в этом сообщении.")
+    _photo_backfill_task = asyncio.create_task(run_photo_backfill(msg, bot))
 
-    for review in reviews:
+async def run_photo_backfill(msg: Message, bot: Bot):
+    async def report_progress(success, failed):
         try:
-            photo_id = review.get('photo_id')
-            if not photo_id:
-                failed += 1
-                continue
-            file_obj = await bot.get_file(photo_id)
-            file_bytes = await bot.download_file(file_obj.file_path)
-            unique_name = f"{uuid.uuid4().hex}.jpg"
-            file_path = media_dir / unique_name
-            with open(file_path, "wb") as f:
-                f.write(file_bytes.read())
-            await db.update_review_photo_path(review['id'], str(file_path))
-            success += 1
-        except Exception as e:
-            print(f"Не удалось сохранить фото для отзыва {review['id']}: {e}")
-            failed += 1
+            await msg.edit_text(f"🔄 Сохраняем локальные фото... Сохранено: {success}, не удалось: {failed}.")
+        except Exception:
+            pass
 
-    await msg.edit_text(f"✅ Готово. Сохранено: {success}, не удалось: {failed}.")
+    try:
+        # Догрузку одновременно ведёт только один процесс (при нескольких воркерах)
+        async with db.try_advisory_lock(db.LOCK_PHOTO_BACKFILL) as locked:
+            if not locked:
+                await msg.edit_text("⏳ Обновление локальных фото уже идёт в другом процессе бота.")
+                return
+            success, failed = await backfill_local_photos(bot, PHOTO_BACKFILL_CONCURRENCY, on_progress=report_progress)
+    except Exception as e:
+        print(f"Ошибка при обновлении локальных фото: {e}")
+        await msg.edit_text("❌ Обновление локальных фото прервано из-за ошибки.")
+        return
+
+    if not success and not failed:
+        await msg.edit_text("✅ Нет отзывов, требующих сохранения локальных фото.")
+    else:
+        await msg.edit_text(f"✅ Готово. Сохранено: {success}, не удалось: {failed}.")
 
 
 @router.message(F.text == "✉️ Попросить прислать фото")
@@ -143,27 +147,20 @@ async def forward_as_review(message: Message, bot: Bot):
         return
     
     # Сохраняем пользователя в БД
-    await db.add_or_update_user(
+    is_new_user = await db.add_or_update_user(
         user_id=forwarded_user.id,
         username=forwarded_user.username,
         first_name=forwarded_user.first_name,
         last_name=forwarded_user.last_name
     )
+    activity.record(forwarded_user.id, "user_joined" if is_new_user else "user_activity")
     
     # Добавляем отзыв сразу как одобренный с рейтингом 5 звезд
     # Если есть фото, попробуем сохранить локальную копию для доступности
     photo_path = None
     try:
         if photo_id:
-            media_dir = Path("media/photos")
-            media_dir.mkdir(parents=True, exist_ok=True)
-            unique_name = f"{uuid.uuid4().hex}.jpg"
-            file_path = media_dir / unique_name
-            file_obj = await bot.get_file(photo_id)
-            file_bytes = await bot.download_file(file_obj.file_path)
-            with open(file_path, "wb") as f:
-                f.write(file_bytes.read())
-            photo_path = str(file_path)
+            photo_path = await save_telegram_photo(bot, photo_id)
     except Exception:
         photo_path = None
 
@@ -217,16 +214,14 @@ async def approve_review(callback: CallbackQuery, bot: Bot):
     except Exception as e:
         print(f"Не удалось уведомить пользователя {review['user_id']}: {e}")
     # Фоновая рассылка всем пользователям (без звука) с кнопкой "Прочитать"
-    try:
-        asyncio.create_task(broadcast_published_review(review_id, bot))
-    except Exception as e:
-        print(f"Не удалось запустить задачу рассылки: {e}")
+    await broadcast_published_review(review_id)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_delete_"))
 async def delete_review_callback(callback: CallbackQuery, bot: Bot):
     review_id = int(callback.data.split("_")[2])
-    await db.delete_review(review_id)
+    photo_path = await db.delete_review(review_id)
+    await release_photo(photo_path)
     await callback.message.edit_text(f"🗑️ Отзыв #{review_id} удалён.")
     await callback.answer("Отзыв удалён.", show_alert=True)
 
@@ -255,9 +250,17 @@ async def show_users_menu(message: Message, state: FSMContext):
     await state.clear() # Сбрасываем состояние на случай, если админ был в другом меню
     await display_users_page(message)
 
-async def display_users_page(message_or_callback, page=1, search_query=None):
-    users, total = await db.get_all_users(page=page, limit=5, search_query=search_query)
-    
+USERS_PAGE_SIZE = 5
+
+async def display_users_page(message_or_callback, cursor=0, page=1, search_query=None):
+    """Страница списка пользователей.
+
+    callback_data кнопок: users_page_{cursor}_{page}, где cursor — user_id, после которого начинается
+    страница. Поисковый запрос хранится в данных FSM (users_search_query), а не в кнопках.
+    """
+    users_page = await db.get_users_page(cursor=cursor, limit=USERS_PAGE_SIZE, search_query=search_query)
+    users = users_page.users
+
     if not users:
         text = "Пользователи не найдены."
         if search_query:
@@ -266,29 +269,31 @@ async def display_users_page(message_or_callback, page=1, search_query=None):
         return
 
     text = f"👥 Пользователи (Страница {page}):\n\n"
-    
+    if search_query:
+        text = f"👥 Пользователи по запросу «{search_query}» (Страница {page}, найдено {users_page.total}):\n\n"
+
     inline_kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text=f"@{user['username'] or user['first_name']}", callback_data=f"user_details_{user['user_id']}")] for user in users
         ]
     )
-    
+
     # Пагинация
     pagination_buttons = []
-    if page > 1:
-        pagination_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"users_page_{page-1}_{search_query or ''}"))
-    if total > page * 5:
-        pagination_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"users_page_{page+1}_{search_query or ''}"))
-    
+    if users_page.prev_cursor is not None:
+        pagination_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"users_page_{users_page.prev_cursor}_{max(page - 1, 1)}"))
+    if users_page.has_next:
+        pagination_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"users_page_{users[-1]['user_id']}_{page + 1}"))
+
     # Кнопка поиска
     search_button = InlineKeyboardButton(text="🔍 Поиск", callback_data="search_user")
-    
+
     # Собираем клавиатуру
     keyboard = inline_kb.inline_keyboard
     if pagination_buttons:
         keyboard.append(pagination_buttons)
     keyboard.append([search_button])
-    
+
     final_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
 
     if isinstance(message_or_callback, Message):
@@ -297,20 +302,24 @@ async def display_users_page(message_or_callback, page=1, search_query=None):
         await message_or_callback.message.edit_text(text, reply_markup=final_markup)
 
 @router.callback_query(F.data.startswith("users_page_"))
-async def paginate_users(callback: CallbackQuery):
+async def paginate_users(callback: CallbackQuery, state: FSMContext):
     # Показываем лоадер
     loader = await loading_user_data(callback)
-    
+
     try:
         parts = callback.data.split("_")
-        page = int(parts[2])
-        search_query = parts[3] if len(parts) > 3 and parts[3] else None
-        await display_users_page(callback, page=page, search_query=search_query)
+        # Старые кнопки (users_page_{page}_{query}) ведут на первую страницу
+        if len(parts) == 4 and parts[2].isdigit() and parts[3].isdigit():
+            cursor, page = int(parts[2]), int(parts[3])
+        else:
+            cursor, page = 0, 1
+        search_query = (await state.get_data()).get("users_search_query")
+        await display_users_page(callback, cursor=cursor, page=page, search_query=search_query)
         await loader.stop()
     except Exception as e:
         await loader.stop("❌ Ошибка загрузки пользователей")
         raise e
-        
+
     await callback.answer()
 
 @router.callback_query(F.data == "search_user")
@@ -322,7 +331,9 @@ async def search_user_start(callback: CallbackQuery, state: FSMContext):
 @router.message(AdminState.user_search_query)
 async def process_user_search(message: Message, state: FSMContext):
     await state.clear()
-    await display_users_page(message, page=1, search_query=message.text)
+    search_query = (message.text or "").strip().lstrip("@")
+    await state.update_data(users_search_query=search_query)
+    await display_users_page(message, search_query=search_query)
 
 @router.callback_query(F.data.startswith("user_details_"))
 async def user_details(callback: CallbackQuery, state: FSMContext):
@@ -337,8 +348,9 @@ async def user_details(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data == "back_to_users_list")
-async def back_to_users(callback: CallbackQuery):
-    await display_users_page(callback, page=1)
+async def back_to_users(callback: CallbackQuery, state: FSMContext):
+    search_query = (await state.get_data()).get("users_search_query")
+    await display_users_page(callback, search_query=search_query)
     await callback.answer()
 
 @router.callback_query(F.data == "write_to_user")
@@ -425,45 +437,30 @@ async def mailing_confirm(callback: CallbackQuery, state: FSMContext, bot: Bot):
     text = data.get("mailing_message")
     await state.clear()
 
-    user_ids = await db.get_active_user_ids()
-    if not user_ids:
+    # Рассылка сохраняется в БД и выполняется фоновым воркером: она переживёт перезапуск бота
+    job_id = await broadcaster.enqueue("mailing", text)
+    job = await db.get_broadcast_job(job_id)
+    if not job['total']:
         await callback.message.answer("Нет активных пользователей для рассылки.")
         await admin_panel(callback.message)
         return
     
-    # Создаем прогресс-лоадер для рассылки
-    progress_loader = MailingProgressLoader(callback.message, len(user_ids))
-    
-    sent_count = 0
-    failed_count = 0
-    
-    for i, user_id in enumerate(user_ids):
-        try:
-            await bot.send_message(user_id, text)
-            sent_count += 1
-            await asyncio.sleep(0.1) # Чтобы не превышать лимиты Telegram
-        except TelegramForbiddenError:
-            failed_count += 1
-            await db.set_user_active(user_id, False)
-        except TelegramBadRequest as e:
-            # Например: "chat not found" / "bot can't initiate conversation with a user"
-            failed_count += 1
-            err_text = str(e).lower()
-            if "chat not found" in err_text or "can't initiate conversation" in err_text:
-                await db.set_user_active(user_id, False)
-        except Exception:
-            failed_count += 1
-        
-        # Обновляем прогресс каждые 5 пользователей или в конце
-        if (i + 1) % 5 == 0 or i == len(user_ids) - 1:
-            await progress_loader.update_progress(sent_count, failed_count)
-    
-    # Завершаем рассылку
-    await progress_loader.finish()
+    # Прогресс следим в фоне: обработчик не должен держать очередь обновлений чата всю рассылку
+    task = asyncio.create_task(watch_mailing(callback.message, job_id))
+    _mailing_watchers.add(task)
+    task.add_done_callback(_mailing_watchers.discard)
+
+# Фоновые наблюдатели за прогрессом рассылок (ссылки, чтобы задачи не собрал GC)
+_mailing_watchers: set[asyncio.Task] = set()
+
+async def watch_mailing(message: Message, job_id: int):
+    # Прогресс-лоадер читает счётчики из записи задания, пока рассылка не завершится
+    progress_loader = MailingProgressLoader(message, job_id)
+    await progress_loader.watch()
     
     # Небольшая пауза перед возвратом в админ-панель
     await asyncio.sleep(2)
-    await admin_panel(callback.message) # Возвращаемся в админ-панель
+    await admin_panel(message) # Возвращаемся в админ-панель
 
 @router.callback_query(F.data == "cancel_mailing", AdminState.mailing_confirmation)
 @router.message(F.text == "❌ Отмена", AdminState.mailing_message)
@@ -542,17 +539,19 @@ async def view_template_detail(callback: CallbackQuery):
 # --- Статистика ---
 @router.message(F.text == "📊 Статистика")
 async def show_statistics(message: Message):
-    # Получаем все данные параллельно
-    total_users = await db.get_total_users_count()
-    total_reviews = await db.get_total_reviews_count()
-    approved_reviews = await db.count_approved_reviews()
-    daily_new_users = await db.get_daily_new_users()
-    daily_reviews = await db.get_daily_reviews()
-    active_today = await db.get_active_users_today()
-    inactive_users = await db.get_inactive_users_count()
-    reviews_by_status = await db.get_reviews_by_status()
-    avg_rating = await db.get_average_rating()
-    rating_distribution = await db.get_rating_distribution()
+    # Получаем все данные одним запросом к БД
+    stats = await db.get_stats_snapshot()
+    total_users = stats.total_users
+    total_reviews = stats.total_reviews
+    approved_reviews = stats.approved_reviews
+    daily_new_users = stats.daily_new_users
+    daily_reviews = stats.daily_reviews
+    active_today = stats.active_today
+    inactive_users = stats.inactive_users
+    reviews_by_status = stats.reviews_by_status
+    avg_rating = stats.avg_rating
+    rating_distribution = stats.rating_distribution
+    media_size = await get_media_size()
     
     # Формируем статистику
     stats_text = "📊 **Статистика бота**\n\n"
@@ -596,6 +595,19 @@ async def show_statistics(message: Message):
             status_name = status_names.get(status, status)
             stats_text += f"• {status_name}: {count}\n"
     
+    # Хранилище фото
+    stats_text += f"\n💾 **Фото на диске:** {media_size / 1024 / 1024:.1f} МБ\n"
+    if media.last_gc_report:
+        stats_text += f"• Последняя очистка освободила: {media.last_gc_report.reclaimed_bytes / 1024 / 1024:.1f} МБ "
+        stats_text += f"({media.last_gc_report.deleted_files} файлов)\n"
+
+    # Исходящие запросы к Telegram в этом процессе (utils/outbound.py)
+    out = outbound.stats()
+    stats_text += f"\n📤 **Исходящие запросы:** {sum(out.requests.values())}\n"
+    for name, count in out.requests.items():
+        stats_text += f"• {name}: {count}, среднее ожидание {out.wait_ms[name] / count:.0f} мс\n"
+    stats_text += f"• Ответов 429: {out.rate_limited}, повторов: {out.retried}, в очереди: {out.queued}\n"
+    
     # Кнопки для дополнительных действий
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_stats")],
@@ -640,8 +652,8 @@ async def show_detailed_statistics(callback: CallbackQuery):
     await callback.answer()
 
 
-async def broadcast_published_review(review_id: int, bot: Bot):
-    """Рассылка уведомления всем пользователям о новом опубликованном отзыве (без звука).
+async def broadcast_published_review(review_id: int):
+    """Ставит в очередь рассылку всем пользователям о новом опубликованном отзыве (без звука).
     Сообщение содержит кнопку 'Прочитать', которая открывает отзыв через callback.
     """
     try:
@@ -649,10 +661,6 @@ async def broadcast_published_review(review_id: int, bot: Bot):
         if not review:
             return
 
-        user_ids = await db.get_active_user_ids()
-        if not user_ids:
-            return
-
         raw_username = review.get('username')
         author = f"@{raw_username}" if raw_username else str(review.get('user_id'))
         text = f"Новый отзыв\nОт: {author}"
@@ -660,19 +668,8 @@ async def broadcast_published_review(review_id: int, bot: Bot):
             [InlineKeyboardButton(text="Прочитать", callback_data=f"view_review_{review_id}_0")]
         ])
 
-        for uid in user_ids:
-            try:
-                await bot.send_message(uid, text, reply_markup=kb, disable_notification=True)
-                await asyncio.sleep(0.05)  # небольшая пауза, чтобы не превысить лимиты
-            except TelegramForbiddenError:
-                await db.set_user_active(uid, False)
-            except TelegramBadRequest as e:
-                err_text = str(e).lower()
-                if "chat not found" in err_text or "can't initiate conversation" in err_text:
-                    await db.set_user_active(uid, False)
-            except Exception as e:
-                # Логируем, но продолжаем рассылку
-                print(f"Не удалось отправить уведомление пользователю {uid}: {e}")
+        # Задание сохраняется в БД; несколько одобрений подряд выполняются по очереди, а не параллельно
+        await broadcaster.enqueue("new_review", text, reply_markup=kb, disable_notification=True)
 
     except Exception as e:
         print(f"Ошибка в broadcast_published_review: {e}")
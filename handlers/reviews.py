@@ -3,9 +3,6 @@
 
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-import os
-import uuid
-from pathlib import Path
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
@@ -13,6 +10,8 @@ from handlers.admin import get_admin_review_keyboard
 import database as db
 from config import ADMIN_ID
 from utils.loader import CallbackLoadingAnimation, loading_photo_upload
+from utils.activity import activity
+from utils.media import save_telegram_photo, release_photo
 
 router = Router()
 
@@ -86,7 +85,7 @@ async def skip_photo_step(callback: CallbackQuery, state: FSMContext, bot: Bot):
 
         review_id = await db.add_review(user.id, user.username, review_text, rating=rating)
 
-        await db.log_user_activity(user.id, "review_created")
+        activity.record(user.id, "review_created")
         await state.clear()
 
         admin_kb = get_admin_review_keyboard(review_id)
@@ -119,16 +118,7 @@ async def review_photo_received(message: Message, state: FSMContext, bot: Bot):
         photo = message.photo[-1]
 
         # Сохраняем файл локально, чтобы фото было доступно даже при смене токена бота
-        media_dir = Path("media/photos")
-        media_dir.mkdir(parents=True, exist_ok=True)
-        unique_name = f"{uuid.uuid4().hex}.jpg"
-        file_path = media_dir / unique_name
-
-        # Скачиваем файл и сохраняем
-        photo_file = await bot.get_file(photo.file_id)
-        photo_bytes = await bot.download_file(photo_file.file_path)
-        with open(file_path, "wb") as f:
-            f.write(photo_bytes.read())
+        file_path = await save_telegram_photo(bot, photo.file_id)
 
         stars = "⭐" * rating
         caption = f"Новый отзыв на проверку от @{user.username}:\n{stars} ({rating}/5)\n\n{review_text}"
@@ -139,11 +129,11 @@ async def review_photo_received(message: Message, state: FSMContext, bot: Bot):
             user.username,
             review_text,
             photo_id=photo.file_id,
-            photo_path=str(file_path),
+            photo_path=file_path,
             rating=rating,
         )
 
-        await db.log_user_activity(user.id, "review_with_photo_created")
+        activity.record(user.id, "review_with_photo_created")
         await state.clear()
 
         admin_kb = get_admin_review_keyboard(review_id)
@@ -173,20 +163,13 @@ async def handle_resend_photo(message: Message, bot: Bot):
     photo = message.photo[-1]
     user = message.from_user
 
-    # Сохраняем локальную копию
-    media_dir = Path("media/photos")
-    media_dir.mkdir(parents=True, exist_ok=True)
-    unique_name = f"{uuid.uuid4().hex}.jpg"
-    file_path = media_dir / unique_name
-
     try:
-        file_obj = await bot.get_file(photo.file_id)
-        file_bytes = await bot.download_file(file_obj.file_path)
-        with open(file_path, "wb") as f:
-            f.write(file_bytes.read())
+        # Сохраняем локальную копию
+        file_path = await save_telegram_photo(bot, photo.file_id)
 
         # Обновляем запись в БД
-        await db.update_review_photo(review_id, photo.file_id, str(file_path))
+        old_path = await db.update_review_photo(review_id, photo.file_id, file_path)
+        await release_photo(old_path)
 
         await message.answer(f"✅ Спасибо! Фото для отзыва #{review_id} сохранено.")
         # Уведомим админа, если нужно
@@ -1,17 +1,25 @@
 # telegram_reviews_bot/handlers/show_reviews.py
+import logging
+
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InputMediaPhoto
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
 from pathlib import Path
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from config import ADMIN_ID
 import database as db
-from utils.loader import loading_reviews, loading_photo, loading_latest_reviews, LoadingAnimation
+from utils.activity import activity
+from utils.media import release_photo
+from utils.loader import loading_reviews, loading_reviews_list, loading_photo, loading_latest_reviews
 
 # Добавляем 1000 к количеству отзывов для отображения
 REVIEWS_COUNT_OFFSET = 1000
+# Сколько отзывов на странице списка и в «Последних отзывах»
+REVIEWS_PAGE_SIZE = 5
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 async def format_review_message(review):
     """Форматирует сообщение с отзывом."""
@@ -25,31 +33,41 @@ async def format_review_message(review):
 
 @router.message(F.text == "👀 Посмотреть отзывы")
 async def show_reviews_cmd(message: Message, bot: Bot):
-    # Показываем лоадер для обычного сообщения
-    loader_msg = await message.answer("🔄 Загружаем отзывы...")
-    loader = LoadingAnimation(loader_msg, "Загружаем отзывы")
-    await loader.start()
+    # Сообщение лоадера появится, только если загрузка затянется, и удалится в stop()
+    loader = await loading_reviews_list(message)
     
     try:
         # Логируем просмотр отзывов
-        await db.log_user_activity(message.from_user.id, "viewed_reviews")
-        await show_reviews_page(message, bot, offset=0)
+        activity.record(message.from_user.id, "viewed_reviews")
+        await show_reviews_page(message, bot)
         await loader.stop()  # Останавливаем лоадер без финального текста
-        
-        # Удаляем сообщение с лоадером
-        try:
-            await loader_msg.delete()
-        except:
-            pass
             
     except Exception as e:
         await loader.stop("❌ Ошибка загрузки отзывов")
         raise e
 
-async def show_reviews_page(message_or_callback, bot: Bot, offset: int):
-    """Отображает страницу с отзывами."""
-    reviews = await db.get_approved_reviews(offset=offset, limit=5)
-    total_reviews = await db.count_approved_reviews()
+def page_ref(cursor: int, number: int) -> str:
+    """Хвост callback_data со ссылкой на страницу списка: курсор страницы и номер её первого отзыва."""
+    return f"{cursor}_{number}"
+
+def parse_page_ref(parts: list[str]) -> tuple[int, int]:
+    """Разбирает хвост callback_data, собранный page_ref().
+
+    Старые кнопки (с offset вместо курсора) и кнопки без ссылки ведут на первую страницу.
+    """
+    if len(parts) >= 2:
+        return int(parts[0]), int(parts[1])
+    return 0, 0
+
+async def show_reviews_page(message_or_callback, bot: Bot, cursor: int = 0, number: int = 0):
+    """Отображает страницу с отзывами.
+
+    cursor — id, старше которого показываются отзывы (0 — первая страница),
+    number — номер первого отзыва на странице, чтобы нумерация не пересчитывалась при листании.
+    """
+    # Строки страницы, общее количество и средняя оценка — одним запросом к БД
+    page = await db.get_review_page(cursor=cursor, limit=REVIEWS_PAGE_SIZE)
+    reviews, total_reviews, avg_rating = page.reviews, page.total, page.avg_rating
 
     if not reviews:
         await message_or_callback.answer("Пока нет ни одного одобренного отзыва.")
@@ -57,30 +75,31 @@ async def show_reviews_page(message_or_callback, bot: Bot, offset: int):
 
     builder = InlineKeyboardBuilder()
     
-    # Рассчитываем номера так, чтобы новые отзывы имели большие номера
-    # (total_reviews + REVIEWS_COUNT_OFFSET) - offset даёт нам номер первого отзыва на текущей странице
+    # Новые отзывы имеют большие номера: у первой страницы первый номер — total_reviews + REVIEWS_COUNT_OFFSET,
+    # дальше номер передаётся в callback_data вместе с курсором
+    first_number = number if cursor and number else total_reviews + REVIEWS_COUNT_OFFSET
+    current_ref = page_ref(cursor, first_number)
     for idx, review in enumerate(reviews):
-        review_number = (total_reviews + REVIEWS_COUNT_OFFSET) - offset - idx
+        review_number = first_number - idx
         # Показываем порядковый номер на странице, а не id из базы
         username = review['username'] or 'аноним'
         photo_emoji = " 📸" if review['photo_id'] else ""
         button_text = f"Отзыв №{review_number} от @{username}{photo_emoji}"
-        # Передаем offset в callback_data для возврата на правильную страницу
-        builder.button(text=button_text, callback_data=f"view_review_{review['id']}_{offset}")
+        # Передаем ссылку на страницу в callback_data для возврата на правильную страницу
+        builder.button(text=button_text, callback_data=f"view_review_{review['id']}_{current_ref}")
 
-    # Кнопка для показа последних 5 отзывов
-    builder.button(text="📋 Последние 5 отзывов", callback_data="show_latest_5")
+    # Кнопка для показа последних отзывов
+    builder.button(text=f"📋 Последние {REVIEWS_PAGE_SIZE} отзывов", callback_data="show_latest_5")
 
-    # Логика пагинации
-    if offset > 0:
-        builder.button(text="⬅️ Назад", callback_data=f"reviews_page_{offset - 5}")
-    if offset + 5 < total_reviews:
-        builder.button(text="Вперёд ➡️", callback_data=f"reviews_page_{offset + 5}")
+    # Логика пагинации (keyset: курсор — id последнего отзыва на странице)
+    if page.prev_cursor is not None:
+        builder.button(text="⬅️ Назад", callback_data=f"reviews_page_{page_ref(page.prev_cursor, first_number + REVIEWS_PAGE_SIZE)}")
+    if page.has_next:
+        next_ref = page_ref(reviews[-1]['id'], first_number - len(reviews))
+        builder.button(text="Вперёд ➡️", callback_data=f"reviews_page_{next_ref}")
     
     builder.adjust(1) # Все кнопки в один столбец
 
-    # Получаем среднюю оценку
-    avg_rating = await db.get_average_rating()
     stars_display = "⭐" * int(round(avg_rating)) if avg_rating > 0 else "Нет оценок"
     
     # Формируем текст с статистикой
@@ -111,8 +130,8 @@ async def paginate_reviews(callback: CallbackQuery, bot: Bot):
     loader = await loading_reviews(callback)
     
     try:
-        offset = int(callback.data.split("_")[2])
-        await show_reviews_page(callback, bot, offset)
+        cursor, number = parse_page_ref(callback.data.split("_")[2:])
+        await show_reviews_page(callback, bot, cursor, number)
         await loader.stop()  # Останавливаем лоадер без финального текста
     except Exception as e:
         await loader.stop("❌ Ошибка загрузки отзывов")
@@ -124,8 +143,8 @@ async def paginate_reviews(callback: CallbackQuery, bot: Bot):
 async def view_single_review(callback: CallbackQuery, bot: Bot):
     parts = callback.data.split("_")
     review_id = int(parts[2])
-    # Получаем offset, если он передан, иначе используем 0
-    offset = int(parts[3]) if len(parts) > 3 else 0
+    # Ссылка на страницу списка, с которой пришли (если не передана — первая страница)
+    ref = page_ref(*parse_page_ref(parts[3:]))
     
     review = await db.get_review(review_id)
 
@@ -136,10 +155,10 @@ async def view_single_review(callback: CallbackQuery, bot: Bot):
     text = await format_review_message(review)
     keyboard = []
     if review['photo_id']:
-        keyboard.append([InlineKeyboardButton(text="🖼️ Показать фото", callback_data=f"show_photo_{review_id}_{offset}")])
+        keyboard.append([InlineKeyboardButton(text="🖼️ Показать фото", callback_data=f"show_photo_{review_id}_{ref}")])
     if callback.from_user.id == ADMIN_ID:
-        keyboard.append([InlineKeyboardButton(text="🗑️ Удалить", callback_data=f"delete_review_{review_id}_{offset}")])
-    keyboard.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{offset}")])
+        keyboard.append([InlineKeyboardButton(text="🗑️ Удалить", callback_data=f"delete_review_{review_id}_{ref}")])
+    keyboard.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{ref}")])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     # Если текущее сообщение фото, заменяем на текст через edit_media
     if callback.message.content_type == 'photo':
@@ -158,12 +177,13 @@ async def view_single_review(callback: CallbackQuery, bot: Bot):
 async def delete_review_from_view(callback: CallbackQuery, bot: Bot):
     parts = callback.data.split("_")
     review_id = int(parts[2])
-    offset = int(parts[3]) if len(parts) > 3 else 0
+    ref = page_ref(*parse_page_ref(parts[3:]))
     
-    await db.delete_review(review_id)
+    photo_path = await db.delete_review(review_id)
+    await release_photo(photo_path)
     
     # Создаем кнопку для возврата на правильную страницу
-    back_button = InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{offset}")
+    back_button = InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{ref}")
     reply_markup = InlineKeyboardMarkup(inline_keyboard=[[back_button]])
     
     await callback.message.edit_text(f"🗑️ Отзыв #{review_id} удалён.", reply_markup=reply_markup)
@@ -173,13 +193,14 @@ async def delete_review_from_view(callback: CallbackQuery, bot: Bot):
 async def show_review_photo(callback: CallbackQuery, bot: Bot):
     parts = callback.data.split("_")
     review_id = int(parts[2])
-    offset = int(parts[3]) if len(parts) > 3 else 0
+    ref = page_ref(*parse_page_ref(parts[3:]))
     
     # Показываем лоадер
     loader = await loading_photo(callback)
     
     try:
-        review = await db.get_review(review_id)
+        # Отзыв и file_id, под которым этот бот уже загружал локальное фото, — одним запросом
+        review = await db.get_review_with_cached_photo(review_id, bot.id)
 
         if not review or not review['photo_id']:
             await loader.stop("❌ Фото не найдено")
@@ -188,27 +209,42 @@ async def show_review_photo(callback: CallbackQuery, bot: Bot):
 
         text = await format_review_message(review)
         # Кнопка для скрытия фото
-        hide_button = InlineKeyboardButton(text="🙈 Скрыть фото", callback_data=f"hide_photo_{review_id}_{offset}")
-        back_button = InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{offset}")
+        hide_button = InlineKeyboardButton(text="🙈 Скрыть фото", callback_data=f"hide_photo_{review_id}_{ref}")
+        back_button = InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"reviews_page_{ref}")
         reply_markup = InlineKeyboardMarkup(inline_keyboard=[[hide_button], [back_button]])
 
-        from aiogram.types import InputMediaPhoto
-
         await loader.stop()  # Останавливаем лоадер перед показом фото
 
-        # Сначала пробуем локальную копию (если есть) — это гарантирует доступность при смене токена
+        # Локальное фото уже загружалось этим ботом — показываем по сохранённому file_id без повторной загрузки
+        cached_file_id = review['cached_file_id']
+        if cached_file_id:
+            try:
+                await callback.message.edit_media(
+                    media=InputMediaPhoto(media=cached_file_id, caption=text),
+                    reply_markup=reply_markup
+                )
+                await callback.answer()
+                return
+            except TelegramBadRequest as e:
+                # Telegram больше не принимает этот file_id — забываем его и загружаем файл заново
+                logger.warning("Закэшированный file_id фото отзыва %s отклонён: %s", review_id, e)
+                await db.drop_cached_review_photo(review_id, bot.id)
+
+        # Локальная копия (если есть) гарантирует доступность при смене токена
         photo_path = review.get('photo_path')
         if photo_path and Path(photo_path).exists():
             try:
-                with open(photo_path, 'rb') as f:
-                    await callback.message.edit_media(
-                        media=InputMediaPhoto(media=f, caption=text),
-                        reply_markup=reply_markup
-                    )
-                    await callback.answer()
-                    return
+                sent = await callback.message.edit_media(
+                    media=InputMediaPhoto(media=FSInputFile(photo_path), caption=text),
+                    reply_markup=reply_markup
+                )
+                # Запоминаем file_id загруженного файла, чтобы следующие показы шли без загрузки
+                if isinstance(sent, Message) and sent.photo:
+                    await db.cache_review_photo_file_id(review_id, bot.id, sent.photo[-1].file_id)
+                await callback.answer()
+                return
             except Exception as e:
-                print(f"Ошибка при отправке локального файла для отзыва {review_id}: {e}")
+                logger.exception("Ошибка при отправке локального файла для отзыва %s", review_id)
 
         # Если локальной копии нет или не получилось — пробуем показать по file_id
         try:
@@ -236,10 +272,10 @@ async def show_review_photo(callback: CallbackQuery, bot: Bot):
 async def hide_review_photo(callback: CallbackQuery, bot: Bot):
     parts = callback.data.split("_")
     review_id = int(parts[2])
-    offset = int(parts[3]) if len(parts) > 3 else 0
+    ref = page_ref(*parse_page_ref(parts[3:]))
     
-    # Создаем новый callback_data с правильным offset
-    callback.data = f"view_review_{review_id}_{offset}"
+    # Создаем новый callback_data с правильной ссылкой на страницу
+    callback.data = f"view_review_{review_id}_{ref}"
     
     # Если текущее сообщение — фото, Telegram не даст заменить на текст, поэтому заменяем на "пустую" картинку с текстом
     await view_single_review(callback, bot)
@@ -247,25 +283,24 @@ async def hide_review_photo(callback: CallbackQuery, bot: Bot):
 
 @router.callback_query(F.data == "show_latest_5")
 async def show_latest_5_reviews(callback: CallbackQuery, bot: Bot):
-    """Показывает последние 5 отзывов развернуто."""
+    """Показывает последние REVIEWS_PAGE_SIZE отзывов развернуто."""
     # Показываем лоадер
     loader = await loading_latest_reviews(callback)
     
     try:
-        reviews = await db.get_approved_reviews(offset=0, limit=5)
-        total_reviews = await db.count_approved_reviews()
+        # Отзывы, общее количество и средняя оценка — одним запросом (keyset-страница и review_stats)
+        page = await db.get_review_page(cursor=0, limit=REVIEWS_PAGE_SIZE, full=True)
+        reviews, total_reviews, avg_rating = page.reviews, page.total, page.avg_rating
         
         if not reviews:
             await loader.stop("❌ Пока нет ни одного одобренного отзыва")
             await callback.answer("Пока нет ни одного одобренного отзыва.", show_alert=True)
             return
     
-        # Получаем среднюю оценку
-        avg_rating = await db.get_average_rating()
         stars_display = "⭐" * int(round(avg_rating)) if avg_rating > 0 else "Нет оценок"
         
         # Формируем большое сообщение со всеми отзывами
-        message_text = f"🌟 **Последние 5 отзывов**\n\n"
+        message_text = f"🌟 **Последние {REVIEWS_PAGE_SIZE} отзывов**\n\n"
         message_text += f"📊 Всего: {total_reviews + REVIEWS_COUNT_OFFSET}\n"
         if avg_rating > 0:
             message_text += f"⭐ Средняя оценка: {stars_display} ({avg_rating:.1f}/5)\n\n"
@@ -4,17 +4,19 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import CommandStart
 import database as db
 from config import ADMIN_ID
+from utils.activity import activity
 
 router = Router()
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
-    await db.add_or_update_user(
+    is_new_user = await db.add_or_update_user(
         user_id=message.from_user.id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
+    activity.record(message.from_user.id, "user_joined" if is_new_user else "user_activity")
     
     kb = [
         [KeyboardButton(text="✍️ Оставить отзыв")],
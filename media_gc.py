@@ -0,0 +1,25 @@
+import argparse
+import asyncio
+import database
+from config import MEDIA_GC_GRACE_SEC
+from utils.media import collect_media_garbage
+
+async def main():
+    parser = argparse.ArgumentParser(description="Удаляет из media/photos фото, на которые не ссылается ни один отзыв.")
+    parser.add_argument(
+        "--grace", type=int, default=MEDIA_GC_GRACE_SEC,
+        help="не трогать файлы моложе стольких секунд (по умолчанию MEDIA_GC_GRACE_SEC)",
+    )
+    args = parser.parse_args()
+
+    await database.init_db()
+    try:
+        report = await collect_media_garbage(grace_period_sec=args.grace)
+    finally:
+        await database.close_db()
+    print(f"Удалено файлов: {report.deleted_files}")
+    print(f"Освобождено: {report.reclaimed_bytes / 1024 / 1024:.1f} МБ")
+    print(f"Размер хранилища: {report.total_bytes / 1024 / 1024:.1f} МБ")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+-- file_id фото, загруженных из локального хранилища, отдельно для каждого бота
+CREATE TABLE IF NOT EXISTS review_photo_cache (
+    review_id INTEGER NOT NULL REFERENCES reviews(id) ON DELETE CASCADE,
+    bot_id BIGINT NOT NULL,
+    file_id TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (review_id, bot_id)
+);
+
+-- Задания рассылок и доставки по ним (utils/broadcast.py)
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    reply_markup TEXT,
+    disable_notification BOOLEAN NOT NULL DEFAULT FALSE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    last_user_id BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    job_id INTEGER NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_id, user_id)
+);
+
+-- Поиск отзывов по файлу фото (подсчёт ссылок в хранилище media/photos)
+CREATE INDEX IF NOT EXISTS idx_reviews_photo_path ON reviews (photo_path) WHERE photo_path IS NOT NULL;
+
+-- Частичный индекс для keyset-пагинации одобренных отзывов (get_review_page)
+CREATE INDEX IF NOT EXISTS idx_reviews_approved_id ON reviews (id DESC) WHERE status = 'approved';
@@ -0,0 +1,39 @@
+-- Счётчики отзывов по (status, rating). Обновляются триггером в той же транзакции,
+-- что и изменение отзыва. Отзыв без оценки учитывается в строке rating = 0.
+CREATE TABLE IF NOT EXISTS review_stats (
+    status TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    review_count BIGINT NOT NULL DEFAULT 0,
+    rating_sum BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (status, rating)
+);
+
+CREATE OR REPLACE FUNCTION review_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE review_stats
+        SET review_count = review_count - 1, rating_sum = rating_sum - COALESCE(OLD.rating, 0)
+        WHERE status = OLD.status AND rating = COALESCE(OLD.rating, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO review_stats (status, rating, review_count, rating_sum)
+        VALUES (NEW.status, COALESCE(NEW.rating, 0), 1, COALESCE(NEW.rating, 0))
+        ON CONFLICT (status, rating) DO UPDATE SET
+            review_count = review_stats.review_count + 1,
+            rating_sum = review_stats.rating_sum + EXCLUDED.rating_sum;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS reviews_stats_trigger ON reviews;
+CREATE TRIGGER reviews_stats_trigger
+AFTER INSERT OR DELETE OR UPDATE OF status, rating ON reviews
+FOR EACH ROW EXECUTE FUNCTION review_stats_apply();
+
+-- Заполняем счётчики по уже существующим отзывам (то же, что reconcile_review_stats)
+LOCK TABLE reviews IN SHARE MODE;
+DELETE FROM review_stats;
+INSERT INTO review_stats (status, rating, review_count, rating_sum)
+SELECT status, COALESCE(rating, 0), COUNT(*), COALESCE(SUM(rating), 0)
+FROM reviews GROUP BY status, COALESCE(rating, 0);
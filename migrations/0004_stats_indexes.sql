@@ -0,0 +1,7 @@
+-- Индексы для фильтров по статусу и по дате в статистике. Условия по датам записаны
+-- полуоткрытыми диапазонами (created_at >= начало дня AND < начало следующего), иначе индекс не используется
+CREATE INDEX IF NOT EXISTS idx_reviews_status_id ON reviews (status, id);
+CREATE INDEX IF NOT EXISTS idx_reviews_created_at ON reviews (created_at);
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+CREATE INDEX IF NOT EXISTS idx_user_activity_user_created ON user_activity (user_id, created_at);
@@ -0,0 +1,105 @@
+-- user_activity разбивается на месячные партиции по created_at. Старые партиции удаляются
+-- целиком (utils/maintenance.py), а дневные итоги по действиям остаются в user_activity_daily.
+
+-- Создаёт партицию за месяц, в который попадает дата. Если строки этого месяца уже успели
+-- попасть в партицию по умолчанию, переносит их в новую партицию.
+CREATE OR REPLACE FUNCTION user_activity_create_partition(month DATE) RETURNS VOID AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month)::DATE;
+    end_date DATE := (date_trunc('month', month) + INTERVAL '1 month')::DATE;
+    part_name TEXT := 'user_activity_p' || to_char(month, 'YYYYMM');
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    IF EXISTS (SELECT 1 FROM user_activity_default WHERE created_at >= start_date AND created_at < end_date) THEN
+        ALTER TABLE user_activity DETACH PARTITION user_activity_default;
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF user_activity FOR VALUES FROM (%L) TO (%L)',
+            part_name, start_date, end_date
+        );
+        INSERT INTO user_activity
+        SELECT * FROM user_activity_default WHERE created_at >= start_date AND created_at < end_date;
+        DELETE FROM user_activity_default WHERE created_at >= start_date AND created_at < end_date;
+        ALTER TABLE user_activity ATTACH PARTITION user_activity_default DEFAULT;
+    ELSE
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF user_activity FOR VALUES FROM (%L) TO (%L)',
+            part_name, start_date, end_date
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет месячные партиции, целиком лежащие раньше cutoff. Возвращает имена удалённых.
+CREATE OR REPLACE FUNCTION user_activity_drop_partitions_before(cutoff DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    part_name TEXT;
+BEGIN
+    FOR part_name IN
+        SELECT c.relname::TEXT
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'user_activity'::regclass
+          AND c.relname ~ '^user_activity_p[0-9]{6}$'
+          AND to_date(substr(c.relname, 16), 'YYYYMM') + INTERVAL '1 month' <= cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('DROP TABLE %I', part_name);
+        RETURN NEXT part_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Старую таблицу переименовываем; последовательность id переходит новой таблице
+DROP INDEX IF EXISTS idx_user_activity_user_created;
+ALTER TABLE user_activity RENAME TO user_activity_legacy;
+ALTER TABLE user_activity_legacy RENAME CONSTRAINT user_activity_pkey TO user_activity_legacy_pkey;
+ALTER SEQUENCE user_activity_id_seq OWNED BY NONE;
+ALTER SEQUENCE user_activity_id_seq AS BIGINT;
+
+CREATE TABLE user_activity (
+    id BIGINT NOT NULL DEFAULT nextval('user_activity_id_seq'),
+    user_id BIGINT NOT NULL,
+    action TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE user_activity_id_seq OWNED BY user_activity.id;
+
+-- Сюда попадают строки, для месяца которых ещё нет партиции
+CREATE TABLE user_activity_default PARTITION OF user_activity DEFAULT;
+CREATE INDEX idx_user_activity_user_created ON user_activity (user_id, created_at);
+
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', created_at)::DATE FROM user_activity_legacy WHERE created_at IS NOT NULL
+    LOOP
+        PERFORM user_activity_create_partition(month);
+    END LOOP;
+    PERFORM user_activity_create_partition(CURRENT_DATE);
+    PERFORM user_activity_create_partition((CURRENT_DATE + INTERVAL '1 month')::DATE);
+END;
+$$;
+
+INSERT INTO user_activity (id, user_id, action, created_at)
+SELECT id, user_id, action, COALESCE(created_at, CURRENT_TIMESTAMP) FROM user_activity_legacy;
+DROP TABLE user_activity_legacy;
+
+-- Дневные итоги: сколько раз выполнено действие и сколькими пользователями
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    day DATE NOT NULL,
+    action TEXT NOT NULL,
+    events BIGINT NOT NULL,
+    users BIGINT NOT NULL,
+    PRIMARY KEY (day, action)
+);
+
+INSERT INTO user_activity_daily (day, action, events, users)
+SELECT created_at::DATE, action, COUNT(*), COUNT(DISTINCT user_id)
+FROM user_activity
+WHERE created_at < CURRENT_DATE
+GROUP BY created_at::DATE, action
+ON CONFLICT (day, action) DO NOTHING;
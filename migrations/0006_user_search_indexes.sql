@@ -0,0 +1,21 @@
+-- Поиск пользователей в админке. С pg_trgm — GIN-индексы по триграммам для ILIKE '%запрос%';
+-- если расширение поставить нельзя (нет прав), — индексы для поиска по началу строки.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm недоступен (%), поиск пользователей будет по началу имени', SQLERRM;
+END;
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING gin (username gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_users_first_name_trgm ON users USING gin (first_name gin_trgm_ops);
+    ELSE
+        CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops);
+        CREATE INDEX IF NOT EXISTS idx_users_first_name_prefix ON users (lower(first_name) text_pattern_ops);
+    END IF;
+END;
+$$;
@@ -0,0 +1,10 @@
+-- Состояния FSM aiogram (FSM_STORAGE=postgres, utils/fsm_storage.py).
+-- Ключ — bot_id:chat_id:user_id[:thread_id]:destiny; записи старше FSM_STATE_TTL_SEC считаются пустыми.
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at);
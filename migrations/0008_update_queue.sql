@@ -0,0 +1,22 @@
+-- Общая очередь обновлений для нескольких воркеров (WORKER_COUNT > 1, utils/workers.py).
+-- shard = chat_id % UPDATE_SHARDS: все обновления чата обрабатывает один воркер по порядку update_id.
+-- Обработанные строки не удаляются сразу (claimed_at), чтобы повторная доставка того же update_id
+-- от Telegram отсеялась по первичному ключу; старые строки чистит фоновая задача.
+CREATE TABLE IF NOT EXISTS update_queue (
+    update_id BIGINT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP,
+    claimed_by INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_update_queue_pending ON update_queue (shard, update_id) WHERE claimed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_update_queue_claimed_at ON update_queue (claimed_at) WHERE claimed_at IS NOT NULL;
+
+-- Когда последний раз запускалась периодическая задача: при нескольких воркерах её выполняет
+-- тот, кто первым «занял» очередной интервал (claim_periodic_job)
+CREATE TABLE IF NOT EXISTS periodic_jobs (
+    name TEXT PRIMARY KEY,
+    last_run TIMESTAMP NOT NULL
+);
@@ -0,0 +1,5 @@
+-- Ошибки выполнения рассылки: сколько раз подряд задание падало и с какой ошибкой.
+-- После MAX_JOB_ATTEMPTS падений подряд (utils/broadcast.py) задание помечается 'failed',
+-- чтобы одно сломанное задание не останавливало все следующие рассылки.
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS last_error TEXT;
@@ -0,0 +1,86 @@
+# telegram_reviews_bot/migrations/__init__.py
+"""Версионные миграции схемы БД.
+
+Каждая миграция — файл NNNN_описание.sql в этой папке; применяется один раз, в своей транзакции,
+номер записывается в schema_migrations. Новую миграцию добавляем следующим номером,
+уже применённые файлы не меняем.
+"""
+import logging
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent
+_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+# Ключ pg_advisory_lock: пока один процесс применяет миграции, остальные ждут
+MIGRATIONS_LOCK_ID = 7_241_001
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+
+
+def load_migrations() -> list[Migration]:
+    """Все миграции из папки по возрастанию номера."""
+    migrations = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        match = _FILE_RE.match(path.name)
+        if not match:
+            raise ValueError(f"Некорректное имя файла миграции: {path.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path.read_text(encoding="utf-8")))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Повторяющиеся номера миграций: {versions}")
+    return migrations
+
+
+async def _current_version(conn: asyncpg.Connection) -> int | None:
+    try:
+        return await conn.fetchval("SELECT MAX(version) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return None
+
+
+async def apply_migrations(conn: asyncpg.Connection) -> list[int]:
+    """Применяет недостающие миграции. Возвращает номера применённых.
+
+    Если схема уже актуальна, делается один SELECT без блокировок и DDL.
+    """
+    migrations = load_migrations()
+    latest = migrations[-1].version if migrations else 0
+    if (await _current_version(conn) or 0) >= latest:
+        return []
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Другой процесс мог применить миграции, пока мы ждали блокировку
+        applied_versions = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        applied = []
+        for migration in migrations:
+            if migration.version in applied_versions:
+                continue
+            logger.info("Применяем миграцию %04d_%s", migration.version, migration.name)
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    migration.version, migration.name,
+                )
+            applied.append(migration.version)
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
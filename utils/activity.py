@@ -0,0 +1,93 @@
+# telegram_reviews_bot/utils/activity.py
+"""Буфер активности пользователей: хендлеры пишут в память, фоновая задача сбрасывает пачками в БД."""
+import asyncio
+import logging
+import time
+
+import database as db
+from config import ACTIVITY_FLUSH_INTERVAL_MS, ACTIVITY_FLUSH_MAX_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий держим в памяти, если БД недоступна; более старые отбрасываются
+MAX_BUFFERED_EVENTS = 50_000
+
+
+class ActivityBuffer:
+    """Копит события (user_id, action) и записывает их раз в flush_interval или по max_events штук."""
+
+    def __init__(self, flush_interval: float, max_events: int):
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        # (user_id, action, время события по time.monotonic())
+        self._events: list[tuple[int, str, float]] = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._worker: asyncio.Task | None = None
+
+    def record(self, user_id: int, action: str):
+        """Добавляет событие в буфер. Не обращается к БД, поэтому вызывается без await."""
+        self._events.append((user_id, action, time.monotonic()))
+        if len(self._events) >= self.max_events:
+            self._full.set()
+
+    def start(self):
+        """Запускает фоновую запись буфера (из bot.py после init_db)."""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Останавливает фоновую задачу и записывает всё, что осталось в буфере."""
+        if self._worker is not None:
+            # Не прерываем запись на середине: отменяем задачу между сбросами
+            async with self._flush_lock:
+                self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Не удалось записать %s событий активности при остановке", len(self._events))
+
+    async def flush(self):
+        """Записывает накопленные события одной транзакцией."""
+        async with self._flush_lock:
+            events, self._events = self._events, []
+            self._full.clear()
+            if not events:
+                return
+            now = time.monotonic()
+            # Для users.last_activity достаточно последнего события каждого пользователя
+            last_seen: dict[int, float] = {}
+            for user_id, _, at in events:
+                last_seen[user_id] = max(at, last_seen.get(user_id, at))
+            try:
+                await db.insert_user_activity_batch(
+                    [(user_id, action, now - at) for user_id, action, at in events],
+                    {user_id: now - at for user_id, at in last_seen.items()},
+                )
+            except BaseException:
+                # Возвращаем события в начало буфера, чтобы записать их при следующей попытке
+                self._events = (events + self._events)[-MAX_BUFFERED_EVENTS:]
+                raise
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка записи активности, повтор через %ss", self.flush_interval)
+                # Буфер мог остаться полным — не крутимся в цикле без паузы
+                await asyncio.sleep(self.flush_interval)
+
+
+activity = ActivityBuffer(flush_interval=ACTIVITY_FLUSH_INTERVAL_MS / 1000, max_events=ACTIVITY_FLUSH_MAX_EVENTS)
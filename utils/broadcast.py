@@ -0,0 +1,182 @@
+# telegram_reviews_bot/utils/broadcast.py
+"""Движок рассылок: задания в Postgres и ограниченная параллельность.
+
+Скорость и повторы после 429 обеспечивает планировщик исходящих (utils/outbound.py, класс BULK).
+"""
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+import database as db
+from utils import metrics
+from utils.outbound import BULK, with_priority
+from config import BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной попыткой, если задание упало с ошибкой БД/сети
+JOB_ERROR_DELAY_SEC = 15
+# После стольких падений подряд задание помечается 'failed' и очередь идёт дальше
+MAX_JOB_ATTEMPTS = 5
+# Как часто проверять очередь заданий без пробуждения: задание мог поставить другой воркер
+JOB_POLL_INTERVAL_SEC = 10
+
+# Результаты отправки одному пользователю
+SENT = "sent"
+FAILED = "failed"
+INACTIVE = "inactive"
+
+
+class Broadcaster:
+    """Выполняет задания из broadcast_jobs строго по одному, продолжая прерванные после перезапуска.
+
+    При нескольких процессах задания выполняет один — держатель pg_advisory_lock LOCK_BROADCASTS;
+    остальные только ставят задания в очередь.
+    """
+
+    def __init__(self, concurrency: int, chunk_size: int):
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.bot: Bot | None = None
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+
+    def start(self, bot: Bot):
+        """Запускает обработку заданий (или подменяет Bot после переподключения)."""
+        self.bot = bot
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        # Сразу проверяем очередь: там могут быть задания, прерванные перезапуском
+        self._wakeup.set()
+
+    async def enqueue(self, kind: str, text: str, reply_markup: InlineKeyboardMarkup | None = None,
+                      disable_notification: bool = False) -> int:
+        """Сохраняет рассылку всем активным пользователям в очередь. Возвращает id задания."""
+        markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        job_id = await db.create_broadcast_job(kind, text, markup_json, disable_notification)
+        self._wakeup.set()
+        return job_id
+
+    async def close(self):
+        """Останавливает обработку (при остановке бота). Незавершённые задания продолжатся при следующем запуске."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        # Рассылки уступают глобальный лимит исходящих ответам пользователям (utils/outbound.py)
+        with with_priority(BULK):
+            await self._process_jobs()
+
+    async def _process_jobs(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # При нескольких воркерах рассылки выполняет только тот, кто взял блокировку
+                async with db.try_advisory_lock(db.LOCK_BROADCASTS) as locked:
+                    if not locked:
+                        continue
+                    while (job := await db.get_next_broadcast_job()) is not None:
+                        try:
+                            await self._run_job(job)
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception as e:
+                            if not await self._job_failed(job["id"], e):
+                                raise
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при выполнении рассылки, повтор через %ss", JOB_ERROR_DELAY_SEC)
+                await asyncio.sleep(JOB_ERROR_DELAY_SEC)
+                self._wakeup.set()
+
+    async def _job_failed(self, job_id: int, error: Exception) -> bool:
+        """Учитывает падение задания. True — попытки исчерпаны, задание помечено 'failed'."""
+        attempts = await db.record_broadcast_job_error(job_id, f"{type(error).__name__}: {error}")
+        if attempts < MAX_JOB_ATTEMPTS:
+            return False
+        logger.error("Рассылка #%s упала %s раз подряд и помечена как failed", job_id, attempts, exc_info=error)
+        await db.finish_broadcast_job(job_id, "failed")
+        return True
+
+    async def _run_job(self, job):
+        job_id = job["id"]
+        if job["status"] == "running":
+            logger.info("Продолжаем рассылку #%s после user_id=%s", job_id, job["last_user_id"])
+        await db.start_broadcast_job(job_id)
+
+        reply_markup = (
+            InlineKeyboardMarkup.model_validate_json(job["reply_markup"]) if job["reply_markup"] else None
+        )
+        last_user_id = job["last_user_id"]
+        while True:
+            user_ids = await db.get_broadcast_recipients(last_user_id, self.chunk_size)
+            if not user_ids:
+                break
+            results = await self.send_batch(
+                self.bot, user_ids, job["text"], reply_markup, job["disable_notification"]
+            )
+            last_user_id = user_ids[-1]
+            for result in results.values():
+                metrics.broadcast_messages.inc(result=result)
+            await db.checkpoint_broadcast_job(
+                job_id,
+                last_user_id,
+                sent_ids=[uid for uid, result in results.items() if result == SENT],
+                failed_ids=[uid for uid, result in results.items() if result != SENT],
+                inactive_ids=[uid for uid, result in results.items() if result == INACTIVE],
+            )
+        await db.finish_broadcast_job(job_id)
+
+    async def send_batch(self, bot: Bot, user_ids: list[int], text: str, reply_markup=None,
+                         disable_notification: bool = False) -> dict[int, str]:
+        """Отправляет сообщение пачке пользователей, не больше concurrency отправок одновременно."""
+        results: dict[int, str] = {}
+        pending = iter(user_ids)
+
+        async def worker():
+            # Итератор общий для всех воркеров: каждый берёт следующего пользователя, пока они не закончатся
+            for user_id in pending:
+                results[user_id] = await self._send_one(bot, user_id, text, reply_markup, disable_notification)
+
+        workers = max(1, min(self.concurrency, len(user_ids)))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+
+    async def _send_one(self, bot: Bot, user_id: int, text: str, reply_markup, disable_notification: bool) -> str:
+        # Лимит скорости, пауза всей рассылки на 429 и повторы — в планировщике исходящих;
+        # сюда 429 доходит, только если повторы исчерпаны
+        try:
+            await bot.send_message(
+                user_id,
+                text,
+                reply_markup=reply_markup,
+                disable_notification=disable_notification,
+            )
+            return SENT
+        except TelegramForbiddenError:
+            return INACTIVE
+        except TelegramBadRequest as e:
+            # Например: "chat not found" / "bot can't initiate conversation with a user"
+            err_text = str(e).lower()
+            if "chat not found" in err_text or "can't initiate conversation" in err_text:
+                return INACTIVE
+            return FAILED
+        except Exception as e:
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", user_id, e)
+            return FAILED
+
+
+broadcaster = Broadcaster(concurrency=BROADCAST_CONCURRENCY, chunk_size=BROADCAST_CHUNK_SIZE)
@@ -0,0 +1,135 @@
+# telegram_reviews_bot/utils/fsm_storage.py
+"""Хранилища состояний FSM aiogram, выбираются переменной FSM_STORAGE.
+
+memory   — MemoryStorage aiogram: состояния теряются при перезапуске (как раньше);
+postgres — таблица fsm_storage в той же базе (DATABASE_URL), просроченные записи чистятся фоном;
+redis    — любой сервер с протоколом Redis (Redis, Valkey, KeyDB, Dragonfly) по FSM_REDIS_URL.
+"""
+import json
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database as db
+from config import FSM_STORAGE, FSM_REDIS_URL, FSM_STATE_TTL_SEC
+
+
+def _storage_key(key: StorageKey) -> str:
+    parts = [key.bot_id, key.chat_id, key.user_id]
+    if key.thread_id:
+        parts.append(key.thread_id)
+    parts.append(key.destiny)
+    return ":".join(map(str, parts))
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class PostgresStorage(BaseStorage):
+    """Состояния FSM в таблице fsm_storage через общий пул соединений database.py."""
+
+    def __init__(self, ttl: int):
+        self.ttl = float(ttl)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await db.fsm_set_state(_storage_key(key), _state_name(state), self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await db.fsm_get_state(_storage_key(key), self.ttl)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await db.fsm_set_data(_storage_key(key), data, self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await db.fsm_get_data(_storage_key(key), self.ttl)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Слияние делает сама БД (jsonb ||) — один запрос вместо get_data + set_data
+        return await db.fsm_update_data(_storage_key(key), data, self.ttl)
+
+    async def close(self) -> None:
+        # Пул принадлежит database.py и закрывается в bot.py
+        pass
+
+
+class RedisStorage(BaseStorage):
+    """Состояния FSM в Redis: состояние — строка fsm:<ключ>:state, данные — хэш fsm:<ключ>:data.
+
+    Каждое поле данных хранится отдельным JSON-значением хэша, поэтому update_data — это HSET
+    нужных полей, EXPIRE и HGETALL в одной транзакции MULTI (один сетевой запрос), без чтения перед записью.
+    Любая запись продлевает TTL обоих ключей, чтобы состояние и данные истекали вместе, как строка в PostgresStorage.
+    """
+
+    def __init__(self, redis, ttl: int, prefix: str = "fsm"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: int) -> "RedisStorage":
+        # Пакет redis нужен только для этого хранилища
+        from redis.asyncio import Redis
+
+        return cls(Redis.from_url(url, decode_responses=True), ttl)
+
+    def _key(self, key: StorageKey, part: str) -> str:
+        return f"{self.prefix}:{_storage_key(key)}:{part}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = _state_name(state)
+        if name is None:
+            await self.redis.delete(self._key(key, "state"))
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(key, "state"), name, ex=self.ttl)
+            pipe.expire(self._key(key, "data"), self.ttl)
+            await pipe.execute()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.redis.get(self._key(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        data_key = self._key(key, "data")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(data_key)
+            if data:
+                pipe.hset(data_key, mapping={name: json.dumps(value) for name, value in data.items()})
+                pipe.expire(data_key, self.ttl)
+            pipe.expire(self._key(key, "state"), self.ttl)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self.redis.hgetall(self._key(key, "data"))
+        return {name: json.loads(value) for name, value in raw.items()}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        data_key = self._key(key, "data")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if data:
+                pipe.hset(data_key, mapping={name: json.dumps(value) for name, value in data.items()})
+                pipe.expire(data_key, self.ttl)
+                pipe.expire(self._key(key, "state"), self.ttl)
+            pipe.hgetall(data_key)
+            results = await pipe.execute()
+        return {name: json.loads(value) for name, value in results[-1].items()}
+
+    async def close(self) -> None:
+        # Dispatcher вызывает close() при каждой остановке поллинга, а bot.py затем запускает его снова,
+        # поэтому только закрываем соединения: пул откроет новые при следующем запросе
+        await self.redis.connection_pool.disconnect()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Хранилище FSM по настройке FSM_STORAGE."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "postgres":
+        return PostgresStorage(ttl=FSM_STATE_TTL_SEC)
+    if FSM_STORAGE == "redis":
+        if not FSM_REDIS_URL:
+            raise RuntimeError("FSM_STORAGE=redis requires FSM_REDIS_URL")
+        return RedisStorage.from_url(FSM_REDIS_URL, ttl=FSM_STATE_TTL_SEC)
+    raise RuntimeError(f"Unknown FSM_STORAGE {FSM_STORAGE!r}: expected memory, postgres or redis")
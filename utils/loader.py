@@ -1,122 +1,165 @@
 # telegram_reviews_bot/utils/loader.py
+"""Индикаторы загрузки для долгих обработчиков.
+
+Лоадер подстраивается под длительность операции: быстрые (до LOADER_SHOW_DELAY_SEC) ничего не
+показывают, средние получают send_chat_action и, если операция дольше LOADER_EDIT_DELAY_SEC, одну
+правку с текстом лоадера, долгие — не чаще одной правки в LOADER_REFRESH_INTERVAL_SEC. Правки всех
+лоадеров расходуют общий бюджет edit_budget: если он исчерпан или Telegram вернул рассылке 429,
+кадр просто пропускается. Финальный текст (stop(final_text)) отправляется всегда. Обработчикам без
+своего сообщения ReplyLoadingAnimation отправляет сообщение лоадера только к первому кадру.
+
+Сообщение лоадера часто правит и сам обработчик (например, показывает страницу и только потом
+вызывает stop()). LoaderEditGuard (middleware сессии Bot, подключается в bot.py) замечает такую
+правку: лоадер больше не трогает сообщение, а правка обработчика ждёт окончания уже начатой правки лоадера.
+"""
 import asyncio
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.enums import ChatAction
+from aiogram.methods import (
+    DeleteMessage,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+)
 from aiogram.types import Message, CallbackQuery
-from aiogram import Bot
+
+import database as db
+from config import LOADER_EDIT_RATE
+from utils.outbound import BACKGROUND, TokenBucket, outbound, with_priority
+
+# Быстрее этого операция завершается без какого-либо индикатора
+LOADER_SHOW_DELAY_SEC = 0.3
+# Дольше этого — одна правка сообщения с текстом лоадера
+LOADER_EDIT_DELAY_SEC = 1.5
+# Долгие операции: следующая правка (и повтор chat action, который живёт 5 с) не чаще этого
+LOADER_REFRESH_INTERVAL_SEC = 4.0
+
+# Общий бюджет правок всех лоадеров (правок в секунду на весь бот)
+edit_budget = TokenBucket(LOADER_EDIT_RATE)
+
+# (chat_id, message_id) -> лоадер, который сейчас анимирует это сообщение
+_active_loaders: dict[tuple, "LoadingAnimation"] = {}
+# Запрос отправляет сам лоадер (а не обработчик)
+_loader_request: ContextVar[bool] = ContextVar("loader_request", default=False)
+
+_MESSAGE_EDIT_METHODS = (EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, DeleteMessage)
+
+
+class LoaderEditGuard(BaseRequestMiddleware):
+    """Middleware сессии: правка или удаление сообщения не из лоадера останавливает его анимацию."""
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, _MESSAGE_EDIT_METHODS) and not _loader_request.get():
+            loader = _active_loaders.get((method.chat_id, method.message_id))
+            if loader is not None:
+                loader.superseded = True
+                # Дожидаемся уже отправленной правки лоадера, чтобы она не перезаписала ответ обработчика
+                async with loader.edit_lock:
+                    pass
+        return await make_request(bot, method)
+
 
 class LoadingAnimation:
-    """Класс для создания анимированных лоадеров."""
-    
-    def __init__(self, message: Message, initial_text: str = "Загрузка..."):
+    """Адаптивный лоадер на сообщении message."""
+
+    frames = ["🔄", "🔃"]
+    dots = ["", ".", "..", "..."]
+
+    def __init__(self, message: Message, initial_text: str = "Загрузка...", action: str = ChatAction.TYPING):
         self.message = message
         self.initial_text = initial_text
+        self.action = action
         self.is_running = False
+        self.superseded = False
+        self.edit_lock = asyncio.Lock()
         self.animation_task = None
-    
+        self._stopped = asyncio.Event()
+        self._key = (message.chat.id, message.message_id)
+        self._last_text = None
+
     async def start(self):
-        """Запускает анимацию загрузки."""
+        """Запускает индикатор. Сам по себе ничего не отправляет — только если операция затянется."""
         if self.is_running:
             return
-        
         self.is_running = True
+        _active_loaders[self._key] = self
         self.animation_task = asyncio.create_task(self._animate())
-    
-    async def stop(self, final_text: str = None):
-        """Останавливает анимацию."""
+
+    async def stop(self, final_text: str = None, reply_markup=None):
+        """Останавливает индикатор и, если передан final_text, показывает его в сообщении."""
         self.is_running = False
+        self._stopped.set()
         if self.animation_task:
-            self.animation_task.cancel()
-            try:
-                await self.animation_task
-            except asyncio.CancelledError:
-                pass
-        
+            # Не отменяем задачу: начатая правка должна завершиться до финальной
+            await self.animation_task
+            self.animation_task = None
+        if _active_loaders.get(self._key) is self:
+            del _active_loaders[self._key]
+
         if final_text:
+            token = _loader_request.set(True)
             try:
-                await self.message.edit_text(final_text)
-            except:
-                pass
-    
+                await self._update_message(final_text, reply_markup)
+            finally:
+                _loader_request.reset(token)
+
+    async def _sleep(self, seconds: float) -> bool:
+        """Ждёт seconds или остановки лоадера. True — лоадер остановлен."""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self._stopped.is_set() or self.superseded
+
     async def _animate(self):
-        """Анимация с вращающимися эмодзи."""
-        frames = ["🔄", "🔃", "🔄", "🔃"]
-        dots = ["", ".", "..", "..."]
-        
-        frame_idx = 0
-        dot_idx = 0
-        
-        while self.is_running:
-            try:
-                current_frame = frames[frame_idx % len(frames)]
-                current_dots = dots[dot_idx % len(dots)]
-                
-                text = f"{current_frame} {self.initial_text}{current_dots}"
-                await self.message.edit_text(text)
-                
-                frame_idx += 1
-                if frame_idx % 2 == 0:  # Меняем точки медленнее
-                    dot_idx += 1
-                
-                await asyncio.sleep(0.5)
-                
-            except Exception:
-                break
+        # Кадры анимации уступают глобальный лимит исходящих ответам пользователям
+        with with_priority(BACKGROUND):
+            await self._animate_frames()
 
-class CallbackLoadingAnimation:
-    """Класс для лоадеров в callback запросах."""
-    
-    def __init__(self, callback: CallbackQuery, initial_text: str = "Загрузка..."):
-        self.callback = callback
-        self.message = callback.message
-        self.initial_text = initial_text
-        self.is_running = False
-        self.animation_task = None
-    
-    async def start(self):
-        """Запускает анимацию загрузки."""
-        if self.is_running:
+    async def _animate_frames(self):
+        try:
+            if await self._sleep(LOADER_SHOW_DELAY_SEC):
+                return
+            await self._chat_action()
+            if await self._sleep(LOADER_EDIT_DELAY_SEC - LOADER_SHOW_DELAY_SEC):
+                return
+            frame = 0
+            while True:
+                frame_text = f"{self.frames[frame % len(self.frames)]} {self.initial_text}{self.dots[frame % len(self.dots)]}"
+                await self._edit(frame_text)
+                frame += 1
+                if await self._sleep(LOADER_REFRESH_INTERVAL_SEC):
+                    return
+                await self._chat_action()
+        except Exception:
+            # Индикатор не должен ломать обработчик
+            pass
+
+    async def _chat_action(self):
+        token = _loader_request.set(True)
+        try:
+            await self.message.bot.send_chat_action(self.message.chat.id, self.action)
+        except Exception:
+            pass
+        finally:
+            _loader_request.reset(token)
+
+    async def _edit(self, text: str):
+        """Кадр анимации: пропускается, если бюджет правок исчерпан или сообщение уже правит обработчик."""
+        if text == self._last_text or outbound.limiter.bucket.paused or not edit_budget.try_acquire():
             return
-        
-        self.is_running = True
-        await self._update_message(f"🔄 {self.initial_text}...")
-        self.animation_task = asyncio.create_task(self._animate())
-    
-    async def stop(self, final_text: str = None, reply_markup=None):
-        """Останавливает анимацию."""
-        self.is_running = False
-        if self.animation_task:
-            self.animation_task.cancel()
-            try:
-                await self.animation_task
-            except asyncio.CancelledError:
-                pass
-        
-        if final_text:
-            await self._update_message(final_text, reply_markup)
-    
-    async def _animate(self):
-        """Анимация с различными эмодзи - более заметная."""
-        frames = ["🔄", "🔃", "🔄", "🔃"]  # Те же, что в LoadingAnimation
-        dots = ["", ".", "..", "..."]
-        
-        frame_idx = 0
-        dot_idx = 0
-        
-        while self.is_running:
+        async with self.edit_lock:
+            if self._stopped.is_set() or self.superseded:
+                return
+            token = _loader_request.set(True)
             try:
-                current_frame = frames[frame_idx % len(frames)]
-                current_dots = dots[dot_idx % len(dots)]
-                
-                text = f"{current_frame} {self.initial_text}{current_dots}"
                 await self._update_message(text)
-                
-                frame_idx += 1
-                if frame_idx % 2 == 0:  # Меняем точки медленнее
-                    dot_idx += 1
-                
-                await asyncio.sleep(0.5)  # Быстрее для более заметной анимации
-                
-            except Exception:
-                break
+                self._last_text = text
+            finally:
+                _loader_request.reset(token)
 
     async def _update_message(self, text: str, reply_markup=None):
         """Аккуратно обновляет сообщение в зависимости от его типа."""
@@ -136,7 +179,61 @@ class CallbackLoadingAnimation:
         except Exception:
             pass
 
+
+class CallbackLoadingAnimation(LoadingAnimation):
+    """Лоадер для callback-запросов: анимирует сообщение с нажатой кнопкой."""
+
+    def __init__(self, callback: CallbackQuery, initial_text: str = "Загрузка...", action: str = ChatAction.TYPING):
+        super().__init__(callback.message, initial_text, action)
+        self.callback = callback
+
+class ReplyLoadingAnimation(LoadingAnimation):
+    """Лоадер для обработчиков, которым нечего править (ответ на команду или кнопку клавиатуры).
+
+    Своё сообщение с текстом лоадера он отправляет только при первом кадре, то есть если операция
+    дольше LOADER_EDIT_DELAY_SEC, и удаляет его в stop(). Быстрые операции обходятся без отправки и удаления.
+    """
+
+    def __init__(self, message: Message, initial_text: str = "Загрузка...", action: str = ChatAction.TYPING):
+        super().__init__(message, initial_text, action)
+        self.loader_message: Message | None = None
+
+    async def _update_message(self, text: str, reply_markup=None):
+        if self.loader_message is not None:
+            await super()._update_message(text, reply_markup)
+            return
+        try:
+            self.loader_message = await self.message.answer(text, reply_markup=reply_markup)
+        except Exception:
+            return
+        # Дальше лоадер правит своё сообщение, и LoaderEditGuard следит уже за ним
+        if _active_loaders.get(self._key) is self:
+            del _active_loaders[self._key]
+        self.message = self.loader_message
+        self._key = (self.message.chat.id, self.message.message_id)
+        if self.is_running:
+            _active_loaders[self._key] = self
+
+    async def stop(self, final_text: str = None, reply_markup=None):
+        """Как LoadingAnimation.stop(); без final_text отправленное сообщение лоадера удаляется."""
+        await super().stop(final_text, reply_markup)
+        if final_text or self.loader_message is None:
+            return
+        token = _loader_request.set(True)
+        try:
+            await self.loader_message.delete()
+        except Exception:
+            pass
+        finally:
+            _loader_request.reset(token)
+
 # Готовые лоадеры для разных операций
+async def loading_reviews_list(message: Message):
+    """Лоадер для списка отзывов по кнопке клавиатуры."""
+    loader = ReplyLoadingAnimation(message, "Загружаем отзывы")
+    await loader.start()
+    return loader
+
 async def loading_reviews(callback: CallbackQuery):
     """Лоадер для загрузки отзывов."""
     loader = CallbackLoadingAnimation(callback, "📄 Загружаем отзывы")
@@ -151,7 +248,7 @@ async def loading_statistics(callback: CallbackQuery):
 
 async def loading_photo(callback: CallbackQuery):
     """Лоадер для загрузки фото."""
-    loader = CallbackLoadingAnimation(callback, "🖼️ Загружаем фото")
+    loader = CallbackLoadingAnimation(callback, "🖼️ Загружаем фото", action=ChatAction.UPLOAD_PHOTO)
     await loader.start()
     return loader
 
@@ -169,19 +266,47 @@ async def loading_user_data(callback: CallbackQuery):
 
 async def loading_photo_upload(message: Message):
     """Лоадер для загрузки фото (для обычных сообщений)."""
-    loader = LoadingAnimation(message, "📸 Обрабатываем фото и отправляем отзыв")
+    loader = LoadingAnimation(message, "📸 Обрабатываем фото и отправляем отзыв", action=ChatAction.UPLOAD_PHOTO)
     await loader.start()
     return loader
 
 class MailingProgressLoader:
-    """Специальный лоадер для рассылки с прогрессом."""
+    """Специальный лоадер для рассылки с прогрессом.
+
+    Прогресс берётся из записи задания в broadcast_jobs, поэтому он виден и для рассылки,
+    которая продолжилась после перезапуска бота.
+    """
     
-    def __init__(self, message: Message, total_users: int):
+    def __init__(self, message: Message, job_id: int, poll_interval: float = 3.0):
         self.message = message
-        self.total_users = total_users
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+        self.total_users = 0
         self.sent_count = 0
         self.failed_count = 0
+        self.job_failed = False
         self.is_running = True
+        self._last_text = None
+    
+    async def watch(self):
+        """Обновляет прогресс по записи задания, пока рассылка не завершится."""
+        with with_priority(BACKGROUND):
+            await self._watch()
+
+    async def _watch(self):
+        while self.is_running:
+            job = await db.get_broadcast_job(self.job_id)
+            if job is None:
+                break
+            self.total_users = job['total']
+            if job['status'] in ('done', 'failed'):
+                self.sent_count = job['sent']
+                self.failed_count = job['failed']
+                self.job_failed = job['status'] == 'failed'
+                break
+            await self.update_progress(job['sent'], job['failed'])
+            await asyncio.sleep(self.poll_interval)
+        await self.finish()
     
     async def update_progress(self, sent: int, failed: int):
         """Обновляет прогресс рассылки."""
@@ -191,7 +316,7 @@ class MailingProgressLoader:
         if not self.is_running:
             return
             
-        progress = (sent + failed) / self.total_users * 100
+        progress = min((sent + failed) / self.total_users * 100, 100.0) if self.total_users > 0 else 0.0
         progress_bar = "█" * int(progress // 5) + "░" * (20 - int(progress // 5))
         
         text = f"📡 **Идет рассылка...**\n\n"
@@ -199,6 +324,10 @@ class MailingProgressLoader:
         text += f"✅ Отправлено: {sent}\n"
         text += f"❌ Не удалось: {failed}\n"
         text += f"📊 Всего пользователей: {self.total_users}"
+        # Прогресс не изменился — не тратим запрос (Telegram всё равно ответит "message is not modified")
+        if text == self._last_text:
+            return
+        self._last_text = text
         
         try:
             await self.message.edit_text(text, parse_mode="Markdown")
@@ -209,7 +338,11 @@ class MailingProgressLoader:
         """Завершает рассылку."""
         self.is_running = False
         
-        text = f"✅ **Рассылка завершена!**\n\n"
+        if self.job_failed:
+            # Задание упало MAX_JOB_ATTEMPTS раз подряд (utils/broadcast.py), подробности — в логах
+            text = f"❌ **Рассылка прервана из-за ошибки**\n\n"
+        else:
+            text = f"✅ **Рассылка завершена!**\n\n"
         text += f"📤 Отправлено: {self.sent_count}\n"
         text += f"❌ Не удалось отправить: {self.failed_count}\n"
         text += f"📊 Всего пользователей: {self.total_users}\n\n"
@@ -0,0 +1,81 @@
+# telegram_reviews_bot/utils/maintenance.py
+"""Периодическое обслуживание БД (запускается из bot.py).
+
+При нескольких воркерах каждый запуск выполняет один процесс — тот, кто занял интервал
+в periodic_jobs (db.claim_periodic_job); остальные этот раз пропускают.
+"""
+import asyncio
+import logging
+
+import database as db
+from config import (
+    REVIEW_STATS_RECONCILE_INTERVAL_SEC,
+    ACTIVITY_MAINTENANCE_INTERVAL_SEC,
+    ACTIVITY_RETENTION_MONTHS,
+    FSM_STATE_TTL_SEC,
+)
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять просроченные состояния FSM из fsm_storage
+FSM_CLEANUP_INTERVAL_SEC = 60 * 60
+# Как часто чистить обработанные строки update_queue (несколько воркеров)
+UPDATE_QUEUE_CLEANUP_INTERVAL_SEC = 10 * 60
+# Сколько хранить обработанные строки update_queue: повторная доставка того же update_id отсеется
+HANDLED_UPDATES_RETENTION_SEC = 60 * 60
+
+
+async def run_review_stats_reconcile_periodically():
+    """Раз в REVIEW_STATS_RECONCILE_INTERVAL_SEC сверяет счётчики review_stats с таблицей reviews."""
+    while True:
+        await asyncio.sleep(REVIEW_STATS_RECONCILE_INTERVAL_SEC)
+        try:
+            if not await db.claim_periodic_job("review_stats_reconcile", REVIEW_STATS_RECONCILE_INTERVAL_SEC):
+                continue
+            await db.reconcile_review_stats()
+            logger.info("Счётчики отзывов пересчитаны")
+        except Exception:
+            logger.exception("Ошибка при пересчёте счётчиков отзывов")
+
+
+async def run_user_activity_maintenance_periodically():
+    """Партиции и дневные итоги user_activity: сразу при запуске, затем раз в ACTIVITY_MAINTENANCE_INTERVAL_SEC."""
+    while True:
+        try:
+            if await db.claim_periodic_job("user_activity_maintenance", ACTIVITY_MAINTENANCE_INTERVAL_SEC):
+                result = await db.maintain_user_activity(ACTIVITY_RETENTION_MONTHS)
+                logger.info(
+                    "Обслуживание user_activity: итогов за дни записано %s, удалены партиции: %s",
+                    result.rolled_up_rows, ", ".join(result.dropped_partitions) or "нет",
+                )
+        except Exception:
+            logger.exception("Ошибка при обслуживании user_activity")
+        await asyncio.sleep(ACTIVITY_MAINTENANCE_INTERVAL_SEC)
+
+
+async def run_fsm_storage_cleanup_periodically():
+    """Удаляет из fsm_storage записи старше FSM_STATE_TTL_SEC (только для FSM_STORAGE=postgres)."""
+    while True:
+        await asyncio.sleep(FSM_CLEANUP_INTERVAL_SEC)
+        try:
+            if not await db.claim_periodic_job("fsm_storage_cleanup", FSM_CLEANUP_INTERVAL_SEC):
+                continue
+            deleted = await db.delete_expired_fsm_states(float(FSM_STATE_TTL_SEC))
+            if deleted:
+                logger.info("Удалено просроченных состояний FSM: %s", deleted)
+        except Exception:
+            logger.exception("Ошибка при очистке состояний FSM")
+
+
+async def run_update_queue_cleanup_periodically():
+    """Удаляет из update_queue обработанные обновления старше HANDLED_UPDATES_RETENTION_SEC (WORKER_COUNT > 1)."""
+    while True:
+        await asyncio.sleep(UPDATE_QUEUE_CLEANUP_INTERVAL_SEC)
+        try:
+            if not await db.claim_periodic_job("update_queue_cleanup", UPDATE_QUEUE_CLEANUP_INTERVAL_SEC):
+                continue
+            deleted = await db.purge_claimed_updates(HANDLED_UPDATES_RETENTION_SEC)
+            if deleted:
+                logger.info("Удалено обработанных обновлений из очереди: %s", deleted)
+        except Exception:
+            logger.exception("Ошибка при очистке update_queue")
@@ -0,0 +1,237 @@
+# telegram_reviews_bot/utils/media.py
+"""Хранилище фото отзывов: потоковое сохранение из Telegram и дедупликация по хэшу."""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import NamedTuple
+
+from aiogram import Bot
+
+import database as db
+from config import MEDIA_MAX_DOWNLOAD_BYTES, MEDIA_GC_INTERVAL_SEC, MEDIA_GC_GRACE_SEC
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = Path("media/photos")
+# Размер куска при скачивании: столько байт максимум держим в памяти на одну загрузку
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT_SEC = 60
+# Сколько отзывов без локального фото брать из БД за раз при догрузке
+BACKFILL_BATCH_SIZE = 200
+# Сколько файлов удалять за один переход в поток при очистке
+GC_DELETE_BATCH_SIZE = 500
+
+
+class MediaDownloadError(Exception):
+    """Файл не удалось сохранить (например, он больше MEDIA_MAX_DOWNLOAD_BYTES)."""
+
+
+def _write_chunk(fh, digest, chunk: bytes):
+    digest.update(chunk)
+    fh.write(chunk)
+
+
+def _store_path(digest_hex: str) -> Path:
+    """media/photos/ab/cd/abcd….jpg — две ступени каталогов, чтобы в одной папке не было тысяч файлов."""
+    return MEDIA_DIR / digest_hex[:2] / digest_hex[2:4] / f"{digest_hex}.jpg"
+
+
+async def save_telegram_photo(bot: Bot, file_id: str) -> str:
+    """Скачивает фото по file_id в хранилище и возвращает путь к сохранённому файлу.
+
+    Файл пишется кусками во временный *.part в отдельном потоке, попутно считается SHA-256.
+    Имя файла — хэш содержимого, поэтому одинаковые фото хранятся один раз: если такой файл
+    уже есть, скачанная копия просто удаляется.
+    """
+    file = await bot.get_file(file_id)
+    if file.file_size and file.file_size > MEDIA_MAX_DOWNLOAD_BYTES:
+        raise MediaDownloadError(f"Файл {file.file_size} байт больше лимита {MEDIA_MAX_DOWNLOAD_BYTES}")
+
+    await asyncio.to_thread(MEDIA_DIR.mkdir, parents=True, exist_ok=True)
+    tmp_path = MEDIA_DIR / f"{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    fh = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        written = 0
+        async for chunk in bot.session.stream_content(
+            url=url,
+            timeout=DOWNLOAD_TIMEOUT_SEC,
+            chunk_size=DOWNLOAD_CHUNK_SIZE,
+            raise_for_status=True,
+        ):
+            written += len(chunk)
+            if written > MEDIA_MAX_DOWNLOAD_BYTES:
+                raise MediaDownloadError(f"Файл больше лимита {MEDIA_MAX_DOWNLOAD_BYTES} байт")
+            await asyncio.to_thread(_write_chunk, fh, digest, chunk)
+        await asyncio.to_thread(fh.close)
+        file_path = _store_path(digest.hexdigest())
+        try:
+            # Такой файл уже есть: обновляем mtime, чтобы ни очистка хранилища, ни release_photo
+            # не удалили его, пока новый отзыв сохраняется в БД
+            await asyncio.to_thread(os.utime, file_path)
+            await asyncio.to_thread(tmp_path.unlink)
+        except FileNotFoundError:
+            await asyncio.to_thread(file_path.parent.mkdir, parents=True, exist_ok=True)
+            await asyncio.to_thread(os.replace, tmp_path, file_path)
+    except BaseException:
+        await asyncio.to_thread(fh.close)
+        await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+        raise
+
+    return str(file_path)
+
+
+def _modified_since(path: Path, cutoff: float) -> bool:
+    try:
+        return path.stat().st_mtime > cutoff
+    except FileNotFoundError:
+        return False
+
+
+async def release_photo(photo_path: str | None):
+    """Удаляет файл из хранилища, если на него больше не ссылается ни один отзыв.
+
+    Файлы моложе MEDIA_GC_GRACE_SEC не трогаем: такое же фото может прямо сейчас сохраняться для
+    нового отзыва (save_telegram_photo обновляет mtime). Их позже уберёт collect_media_garbage.
+    """
+    if not photo_path:
+        return
+    path = Path(photo_path)
+    # Удаляем только файлы внутри хранилища
+    if MEDIA_DIR.resolve() not in path.resolve().parents:
+        return
+    if await db.count_reviews_with_photo_path(photo_path) > 0:
+        return
+    if await asyncio.to_thread(_modified_since, path, time.time() - MEDIA_GC_GRACE_SEC):
+        return
+    await asyncio.to_thread(path.unlink, missing_ok=True)
+
+
+async def backfill_local_photos(bot: Bot, concurrency: int, on_progress=None) -> tuple[int, int]:
+    """Сохраняет локальные копии фото для всех отзывов без photo_path. Возвращает (сохранено, не удалось).
+
+    Отзывы читаются пачками по id (без ограничения на общее количество), внутри пачки фото
+    скачиваются параллельно `concurrency` воркерами, пути записываются в БД одним UPDATE на пачку.
+    on_progress(сохранено, не удалось) вызывается после каждой пачки.
+    """
+    success = 0
+    failed = 0
+    after_id = 0
+    while True:
+        reviews = await db.get_reviews_missing_photo_path(limit=BACKFILL_BATCH_SIZE, after_id=after_id)
+        if not reviews:
+            break
+        after_id = reviews[-1]['id']
+
+        paths: dict[int, str] = {}
+        pending = iter(reviews)
+
+        async def worker():
+            nonlocal failed
+            for review in pending:
+                try:
+                    paths[review['id']] = await save_telegram_photo(bot, review['photo_id'])
+                except Exception as e:
+                    logger.warning("Не удалось сохранить фото для отзыва %s: %s", review['id'], e)
+                    failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(reviews))))))
+        await db.update_review_photo_paths(paths)
+        success += len(paths)
+        if on_progress:
+            await on_progress(success, failed)
+
+    return success, failed
+
+
+class MediaGcReport(NamedTuple):
+    """Результат очистки хранилища фото."""
+    deleted_files: int
+    reclaimed_bytes: int
+    total_bytes: int  # размер хранилища после очистки
+
+
+# Результат последней очистки в этом процессе (для статистики в админке)
+last_gc_report: MediaGcReport | None = None
+
+
+def _find_orphans(referenced: set[Path], cutoff: float) -> tuple[list[tuple[Path, int]], int]:
+    orphans = []
+    total = 0
+    if not MEDIA_DIR.exists():
+        return orphans, total
+    for path in MEDIA_DIR.rglob("*"):
+        if not path.is_file():
+            continue
+        stat = path.stat()
+        total += stat.st_size
+        # Свежие файлы (и незаконченные загрузки) могут ещё не попасть в БД
+        if stat.st_mtime > cutoff:
+            continue
+        # Превью <hash>_thumb.jpg от прежних версий ни на что не ссылаются и тоже удаляются
+        if path.resolve() not in referenced:
+            orphans.append((path, stat.st_size))
+    return orphans, total
+
+
+def _delete_files(files: list[tuple[Path, int]]) -> int:
+    reclaimed = 0
+    for path, size in files:
+        try:
+            path.unlink()
+            reclaimed += size
+        except FileNotFoundError:
+            pass
+    return reclaimed
+
+
+def _media_size() -> int:
+    if not MEDIA_DIR.exists():
+        return 0
+    return sum(path.stat().st_size for path in MEDIA_DIR.rglob("*") if path.is_file())
+
+
+async def get_media_size() -> int:
+    """Текущий размер хранилища фото в байтах."""
+    return await asyncio.to_thread(_media_size)
+
+
+async def collect_media_garbage(grace_period_sec: int = MEDIA_GC_GRACE_SEC) -> MediaGcReport:
+    """Удаляет из media/photos файлы старше grace_period_sec, на которые не ссылается ни один отзыв."""
+    global last_gc_report
+    referenced = {Path(p).resolve() for p in await db.get_all_photo_paths()}
+    orphans, total = await asyncio.to_thread(_find_orphans, referenced, time.time() - grace_period_sec)
+
+    reclaimed = 0
+    for i in range(0, len(orphans), GC_DELETE_BATCH_SIZE):
+        reclaimed += await asyncio.to_thread(_delete_files, orphans[i:i + GC_DELETE_BATCH_SIZE])
+
+    last_gc_report = MediaGcReport(
+        deleted_files=len(orphans),
+        reclaimed_bytes=reclaimed,
+        total_bytes=total - reclaimed,
+    )
+    return last_gc_report
+
+
+async def run_media_gc_periodically():
+    """Фоновая очистка хранилища раз в MEDIA_GC_INTERVAL_SEC (запускается из bot.py)."""
+    while True:
+        await asyncio.sleep(MEDIA_GC_INTERVAL_SEC)
+        try:
+            # При нескольких воркерах (общая папка media/) очистку выполняет один из них
+            if not await db.claim_periodic_job("media_gc", MEDIA_GC_INTERVAL_SEC):
+                continue
+            report = await collect_media_garbage()
+            logger.info(
+                "Очистка медиа: удалено файлов %s, освобождено %s байт, размер хранилища %s байт",
+                report.deleted_files, report.reclaimed_bytes, report.total_bytes,
+            )
+        except Exception:
+            logger.exception("Ошибка при очистке медиа")
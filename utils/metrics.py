@@ -0,0 +1,249 @@
+# telegram_reviews_bot/utils/metrics.py
+"""Метрики в формате Prometheus на локальном HTTP-эндпоинте /metrics (METRICS_HOST:METRICS_PORT).
+
+Собираются: число обновлений по типам и время их обработки, время и ошибки каждого обработчика
+(middleware диспетчера), время запросов к БД по типу запроса и таблице, ожидание соединения и
+заполненность пула (database.py), время и ошибки запросов к Bot API по методам (middleware сессии),
+очередь и 429 планировщика исходящих (utils/outbound.py) и скорость рассылок (utils/broadcast.py).
+Значения живут в памяти процесса; при нескольких воркерах каждый отдаёт свои на METRICS_PORT + WORKER_INDEX.
+"""
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import Update
+from aiohttp import web
+
+# Границы гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        """(суффикс имени, значения меток, доп. метка, значение) для каждого ряда."""
+        return []
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, values, extra)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._values: defaultdict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self._key(labels)] += amount
+
+    def samples(self):
+        return [("", key, "", value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # ключ меток -> [счётчики по границам..., +Inf], сумма
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: defaultdict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        result = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                result.append(("_bucket", key, f'le="{bound}"', cumulative))
+            result.append(("_sum", key, "", self._sums[key]))
+            result.append(("_count", key, "", cumulative))
+        return result
+
+
+class Callback(_Metric):
+    """Значения, которые считаются в момент запроса /metrics: fn() -> {значения меток: число}."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, labels: tuple, fn):
+        super().__init__(name, documentation, labels)
+        self.type = metric_type
+        self.fn = fn
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        return [("", key if isinstance(key, tuple) else (key,), "", value) for key, value in values.items()]
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Обновления и обработчики ---
+
+updates_total = Counter("bot_updates_total", "Updates received, by type.", ("type",))
+update_duration = Histogram("bot_update_duration_seconds", "Time to process an update, by type.", ("type",))
+handler_duration = Histogram("bot_handler_duration_seconds", "Handler latency.", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by handlers.", ("handler", "error"))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware на dp.update: число обновлений по типам и полное время обработки."""
+
+    async def __call__(self, handler, event: Update, data):
+        update_type = event.event_type
+        updates_total.inc(type=update_type)
+        with update_duration.time(type=update_type):
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware на событиях: время и ошибки конкретного обработчика (по имени функции)."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name)
+
+
+def setup_dispatcher_metrics(dp: Dispatcher):
+    """Подключает middleware метрик к диспетчеру (inner middleware наследуются вложенными роутерами)."""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(HandlerMetricsMiddleware())
+
+
+# --- База данных ---
+
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Database query latency, by statement and main table.", ("statement", "table"),
+)
+db_query_errors = Counter("db_query_errors_total", "Failed database queries.", ("statement", "table"))
+db_pool_wait = Histogram("db_pool_acquire_seconds", "Time waiting for a pooled connection.")
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+
+
+def observe_db_query(record):
+    """Query logger asyncpg (conn.add_query_logger): время запроса с метками «тип запроса» и «таблица»."""
+    query = record.query
+    statement = query.split(None, 1)[0].lower() if query.strip() else "unknown"
+    match = _TABLE_RE.search(query)
+    table = match.group(1).lower() if match else ""
+    db_query_duration.observe(record.elapsed, statement=statement, table=table)
+    if record.exception is not None:
+        db_query_errors.inc(statement=statement, table=table)
+
+
+# --- Bot API ---
+
+api_duration = Histogram("telegram_api_request_duration_seconds", "Bot API request latency, by method.", ("method",))
+api_errors = Counter("telegram_api_errors_total", "Bot API errors, by method and error code.", ("method", "code"))
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: время каждого запроса к Bot API и ошибки (429 — code="429")."""
+
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            api_errors.inc(method=method_name, code="429")
+            raise
+        except TelegramAPIError as e:
+            api_errors.inc(method=method_name, code=type(e).__name__)
+            raise
+        finally:
+            api_duration.observe(time.perf_counter() - started, method=method_name)
+
+
+# --- Рассылки ---
+
+broadcast_messages = Counter(
+    "broadcast_messages_total", "Broadcast messages by result (sent, failed, inactive).", ("result",),
+)
+
+
+# --- HTTP ---
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Запускает HTTP-сервер с GET /metrics. Остановить: await runner.cleanup()."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,254 @@
+# telegram_reviews_bot/utils/outbound.py
+"""Планировщик исходящих запросов к Bot API: лимиты Telegram на чат и на бота, приоритеты и 429.
+
+OutboundScheduler подключается к сессии Bot (bot.py) как middleware и пропускает через себя все
+отправки и правки сообщений (send*/edit*/copy/forward), откуда бы они ни вызывались:
+- в один чат — не быстрее OUTBOUND_CHAT_RATE сообщений в секунду (с запасом OUTBOUND_CHAT_BURST);
+- всего — не быстрее OUTBOUND_GLOBAL_RATE в секунду на бота (делится между WORKER_COUNT процессами);
+- при нехватке глобального лимита первыми уходят ответы пользователям, затем фоновые правки
+  (анимация лоадеров, прогресс рассылки), затем рассылки;
+- на 429 чат (а для рассылок и весь бот) ставится на паузу retry_after, запрос повторяется
+  до OUTBOUND_MAX_RETRIES раз, если retry_after не больше OUTBOUND_MAX_RETRY_AFTER_SEC.
+Класс запроса задаётся контекстом: with_priority(BULK) действует на всё, что вызвано внутри.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from utils import metrics
+from config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_MAX_RETRIES,
+    OUTBOUND_MAX_RETRY_AFTER_SEC,
+    WORKER_COUNT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Классы запросов: меньше — важнее
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BULK: "bulk"}
+
+# Сколько корзин чатов держать, прежде чем выбросить неактивные (с полным запасом токенов)
+MAX_CHAT_BUCKETS = 10_000
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Ограничитель скорости исходящих сообщений (rate в секунду, запас capacity)."""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов на время retry_after, которое прислал Telegram."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    @property
+    def idle(self) -> bool:
+        """Запас токенов полный: через ограничитель давно ничего не проходило."""
+        now = time.monotonic()
+        return now >= self._paused_until and self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    def next_token_in(self) -> float:
+        """Через сколько секунд появится свободный токен (0 — уже есть)."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    @property
+    def paused(self) -> bool:
+        """Telegram недавно ответил 429 и retry_after ещё не истёк."""
+        return time.monotonic() < self._paused_until
+
+    def try_acquire(self) -> bool:
+        """Берёт токен, только если он есть прямо сейчас (для необязательных запросов вроде анимации лоадеров)."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def acquire(self):
+        """Ждёт свободный токен. Ожидающие обслуживаются по очереди."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@contextmanager
+def with_priority(priority: int):
+    """Запросы к Bot API внутри блока (и в задачах, созданных в нём) идут с классом priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _is_message_method(method) -> bool:
+    name = type(method).__name__
+    return name.startswith(("Send", "Edit", "Copy", "Forward")) and name != "SendChatAction"
+
+
+class PriorityRateLimiter:
+    """Token bucket, в котором ожидающие получают токены по приоритету, а внутри класса — по очереди."""
+
+    def __init__(self, rate: float):
+        self.bucket = TokenBucket(rate)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._drainer: asyncio.Task | None = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        await future
+
+    async def _drain(self):
+        while self._waiters:
+            if not self.bucket.try_acquire():
+                await asyncio.sleep(self.bucket.next_token_in())
+                continue
+            # Отменённые ожидания (например, по таймауту запроса) токен не получают
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+
+class OutboundStats(NamedTuple):
+    """Счётчики планировщика с момента запуска процесса."""
+    requests: dict[str, int]        # запросов по классам
+    wait_ms: dict[str, float]       # суммарное ожидание в очереди по классам, мс
+    rate_limited: int               # ответов 429
+    retried: int                    # повторов после 429
+    queued: int                     # ждут глобальный лимит прямо сейчас
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии Bot: лимиты, приоритеты и повтор после 429 для отправок и правок."""
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int,
+                 max_retries: int, max_retry_after: float):
+        self.limiter = PriorityRateLimiter(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._requests: Counter[int] = Counter()
+        self._wait: Counter[int] = Counter()
+        self._rate_limited = 0
+        self._retried = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # Полная корзина = в чат давно ничего не отправляли, её можно создать заново
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        if not _is_message_method(method):
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self.limiter.acquire(priority)
+            self._requests[priority] += 1
+            self._wait[priority] += (time.monotonic() - started) * 1000
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._rate_limited += 1
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                if priority == BULK or chat_id is None:
+                    # 429 на рассылке — почти наверняка общий лимит бота
+                    self.limiter.bucket.pause(e.retry_after)
+                if attempt == self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                self._retried += 1
+                logger.info("429 на %s (чат %s), повтор через %sс", type(method).__name__, chat_id, e.retry_after)
+
+    def stats(self) -> OutboundStats:
+        return OutboundStats(
+            requests={PRIORITY_NAMES[p]: n for p, n in sorted(self._requests.items())},
+            wait_ms={PRIORITY_NAMES[p]: round(ms, 1) for p, ms in sorted(self._wait.items())},
+            rate_limited=self._rate_limited,
+            retried=self._retried,
+            queued=self.limiter.queued,
+        )
+
+
+outbound = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE / WORKER_COUNT,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_retries=OUTBOUND_MAX_RETRIES,
+    max_retry_after=OUTBOUND_MAX_RETRY_AFTER_SEC,
+)
+
+metrics.Callback("outbound_requests_total", "Outgoing sends and edits, by priority class.", "counter", ("priority",),
+                 lambda: outbound.stats().requests)
+metrics.Callback("outbound_wait_seconds_total", "Time spent waiting for rate limits, by priority class.", "counter",
+                 ("priority",), lambda: {p: ms / 1000 for p, ms in outbound.stats().wait_ms.items()})
+metrics.Callback("outbound_rate_limited_total", "429 responses to outgoing sends and edits.", "counter", (),
+                 lambda: {(): outbound.stats().rate_limited})
+metrics.Callback("outbound_retries_total", "Outgoing requests retried after 429.", "counter", (),
+                 lambda: {(): outbound.stats().retried})
+metrics.Callback("outbound_queued", "Requests waiting for the global rate limit.", "gauge", (),
+                 lambda: {(): outbound.stats().queued})
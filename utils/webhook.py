@@ -0,0 +1,209 @@
+# telegram_reviews_bot/utils/webhook.py
+"""Режим вебхука: aiohttp-сервер принимает обновления от Telegram и раскладывает их по очередям чатов.
+
+Обновления одного чата обрабатываются строго по порядку, разные чаты — параллельно (не больше
+WEBHOOK_WORKERS одновременно). Очереди ограничены: если они заполнены, сервер отвечает 503 и
+Telegram повторит доставку позже.
+"""
+import asyncio
+import hmac
+import logging
+import signal
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать обработки уже принятых обновлений при остановке
+SHUTDOWN_DRAIN_TIMEOUT_SEC = 25
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: Update) -> int | None:
+    """Чат, к которому относится обновление (для сообщений и нажатий кнопок)."""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return None
+    chat = getattr(event, "chat", None)
+    if chat is None and update.callback_query is not None and update.callback_query.message is not None:
+        chat = update.callback_query.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class UpdateQueue:
+    """Очереди обновлений по чатам и общий пул обработчиков.
+
+    У каждого чата с ожидающими обновлениями своя очередь и своя задача, которая разбирает её по
+    порядку; одновременно обрабатывается не больше concurrency обновлений. Медленный обработчик
+    задерживает только свой чат. Всего в очередях не больше max_size обновлений.
+    """
+
+    def __init__(self, handle, concurrency: int, max_size: int):
+        self.handle = handle
+        self.max_size = max_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats: dict[int, deque[Update]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._size = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def put_nowait(self, update: Update):
+        """Кладёт обновление в очередь его чата. asyncio.QueueFull — очереди переполнены."""
+        if self._size >= self.max_size:
+            raise asyncio.QueueFull
+        chat_id = update_chat_id(update) or 0
+        self._size += 1
+        self._idle.clear()
+        pending = self._chats.get(chat_id)
+        if pending is not None:
+            pending.append(update)
+            return
+        self._chats[chat_id] = deque([update])
+        task = asyncio.create_task(self._drain_chat(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain_chat(self, chat_id: int):
+        pending = self._chats[chat_id]
+        try:
+            while pending:
+                update = pending[0]
+                async with self._slots:
+                    await self.handle(update)
+                pending.popleft()
+                self._size -= 1
+        finally:
+            # Очередь чата пуста (или задачу отменили при остановке) — чат больше не активен
+            self._size -= len(pending)
+            del self._chats[chat_id]
+            if self._size == 0:
+                self._idle.set()
+
+    def qsize(self) -> int:
+        return self._size
+
+    async def join(self):
+        await self._idle.wait()
+
+    async def close(self):
+        """Отменяет обработку оставшихся обновлений."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class WebhookServer:
+    """aiohttp-приложение вебхука и очередь, передающая обновления в Dispatcher.
+
+    Если задан enqueue, обновления не обрабатываются в этом процессе, а передаются в enqueue
+    (общая очередь нескольких воркеров, utils/workers.py).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, enqueue=None):
+        self.dp = dp
+        self.bot = bot
+        self.enqueue = enqueue
+        self.queue = UpdateQueue(self._handle, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+        self.accepting = False
+        self.app = web.Application()
+        self.app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        self.app.router.add_get("/healthz", self.handle_health)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        # Сравниваем байты: compare_digest на str с не-ASCII символами бросает TypeError
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=403)
+        if not self.accepting:
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        if self.enqueue is not None:
+            try:
+                await self.enqueue(update)
+            except Exception:
+                logger.exception("Не удалось сохранить update_id=%s в общую очередь", update.update_id)
+                return web.Response(status=503)
+            return web.Response()
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь обновлений переполнена, update_id=%s вернётся повторно", update.update_id)
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"status": "ok" if self.accepting else "stopping", "queued_updates": self.queue.qsize()},
+            status=200 if self.accepting else 503,
+        )
+
+    async def _handle(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Ошибка при обработке update_id=%s", update.update_id)
+
+    async def run(self, stop: asyncio.Event | None = None):
+        """Регистрирует вебхук, обслуживает запросы до stop (по умолчанию SIGTERM/SIGINT) и корректно останавливается."""
+        if stop is None:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:
+                    # Windows: остановка по Ctrl+C через KeyboardInterrupt
+                    pass
+
+        # Обновления обрабатываются здесь же, только если нет общей очереди
+        local = self.enqueue is None
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        if local:
+            await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            self.accepting = True
+            await self.bot.set_webhook(
+                url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+            logger.info("Вебхук слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+            await stop.wait()
+        finally:
+            # Новые обновления больше не принимаем (Telegram повторит их на другом экземпляре или
+            # после перезапуска), уже принятые дообрабатываем
+            self.accepting = False
+            if local:
+                try:
+                    await asyncio.wait_for(self.queue.join(), timeout=SHUTDOWN_DRAIN_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    logger.warning("Не дождались обработки %s обновлений при остановке", self.queue.qsize())
+            await self.queue.close()
+            await runner.cleanup()
+            if local:
+                await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
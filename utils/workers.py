@@ -0,0 +1,171 @@
+# telegram_reviews_bot/utils/workers.py
+"""Несколько процессов бота (WORKER_COUNT > 1): общая очередь обновлений в Postgres с шардированием по чату.
+
+Приём: в режиме webhook каждый экземпляр кладёт обновления в update_queue; в режиме polling
+getUpdates делает ровно один процесс — тот, кто держит advisory lock LOCK_UPDATE_POLLING
+(если он упадёт, блокировку подхватит другой).
+Обработка: обновление чата попадает в шард chat_id % UPDATE_SHARDS, шард s принадлежит воркеру
+s % WORKER_COUNT. Воркер держит advisory lock на каждый свой шард и обрабатывает шард строго по
+порядку update_id в отдельном цикле, разные шарды — параллельно и независимо друг от друга.
+"""
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.types import Update
+
+import database as db
+from config import UPDATE_SHARDS, WORKER_COUNT, WORKER_INDEX
+from utils.webhook import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений забирать из очереди за раз
+CLAIM_BATCH_SIZE = 100
+# Страховочный опрос очереди каждым шардом, если уведомление NOTIFY потерялось
+QUEUE_POLL_INTERVAL_SEC = 5.0
+# Как часто пытаться снова взять блокировку getUpdates / занятых шардов
+LOCK_RETRY_INTERVAL_SEC = 10
+POLLING_TIMEOUT_SEC = 30
+
+
+def update_shard(update: Update) -> int:
+    return (update_chat_id(update) or 0) % UPDATE_SHARDS
+
+
+async def enqueue_update(update: Update):
+    """Кладёт одно обновление в общую очередь (используется вебхуком)."""
+    await db.enqueue_updates([(update.update_id, update_shard(update), update.model_dump_json(exclude_unset=True))])
+
+
+async def _wait(event: asyncio.Event, timeout: float):
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def poll_into_queue(bot: Bot, dp: Dispatcher, stop: asyncio.Event):
+    """getUpdates -> update_queue. Работает только в процессе, взявшем LOCK_UPDATE_POLLING."""
+    allowed_updates = dp.resolve_used_update_types()
+    while not stop.is_set():
+        async with db.try_advisory_lock(db.LOCK_UPDATE_POLLING) as locked:
+            if not locked:
+                await _wait(stop, LOCK_RETRY_INTERVAL_SEC)
+                continue
+            logger.info("Воркер %s получает обновления через getUpdates", WORKER_INDEX)
+            try:
+                await bot.delete_webhook(request_timeout=60)
+            except TelegramNetworkError as e:
+                logger.warning("delete_webhook failed: %s", e)
+            offset = None
+            while not stop.is_set():
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset, timeout=POLLING_TIMEOUT_SEC, allowed_updates=allowed_updates
+                    )
+                except TelegramNetworkError as e:
+                    logger.warning("getUpdates failed, retry in 5s: %s", e)
+                    await _wait(stop, 5)
+                    continue
+                if not updates:
+                    continue
+                # Сначала сохраняем, потом сдвигаем offset: при сбое Telegram отдаст их ещё раз,
+                # а повтор отсеется по update_id
+                await db.enqueue_updates([
+                    (update.update_id, update_shard(update), update.model_dump_json(exclude_unset=True))
+                    for update in updates
+                ])
+                offset = updates[-1].update_id + 1
+
+
+class SharedUpdateConsumer:
+    """Обрабатывает обновления своих шардов из update_queue."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.shards = [shard for shard in range(UPDATE_SHARDS) if shard % WORKER_COUNT == WORKER_INDEX]
+        self.locked_shards: list[int] = []
+        self.handled = 0
+
+    async def _lock_shards(self, conn):
+        for shard in self.shards:
+            if shard in self.locked_shards:
+                continue
+            if await conn.fetchval("SELECT pg_try_advisory_lock($1)", db.LOCK_UPDATE_SHARD_BASE + shard):
+                self.locked_shards.append(shard)
+        if len(self.locked_shards) < len(self.shards):
+            logger.error(
+                "Воркер %s: шарды %s заняты другим процессом (два воркера с одним WORKER_INDEX?)",
+                WORKER_INDEX, sorted(set(self.shards) - set(self.locked_shards)),
+            )
+
+    async def _run_shard(self, shard: int, wakeup: asyncio.Event, stop: asyncio.Event):
+        """Цикл одного шарда: забрать пачку, обработать строго по очереди, повторить.
+
+        У каждого шарда свой цикл, поэтому долгий обработчик задерживает только свой шард.
+        """
+        while not stop.is_set():
+            wakeup.clear()
+            try:
+                rows = await db.claim_updates([shard], CLAIM_BATCH_SIZE, WORKER_INDEX)
+            except Exception:
+                # Сбой БД не должен навсегда остановить шард: пробуем снова чуть позже
+                logger.exception("Воркер %s: не удалось забрать обновления шарда %s", WORKER_INDEX, shard)
+                await _wait(stop, LOCK_RETRY_INTERVAL_SEC)
+                continue
+            if not rows:
+                # Ждём NOTIFY с номером этого шарда (или остановку)
+                await _wait(wakeup, QUEUE_POLL_INTERVAL_SEC)
+                continue
+            for row in rows:
+                try:
+                    update = Update.model_validate_json(row["payload"], context={"bot": self.bot})
+                    await self.dp.feed_update(self.bot, update)
+                except Exception:
+                    logger.exception("Ошибка при обработке update_id=%s", row["update_id"])
+                self.handled += 1
+
+    async def run(self, stop: asyncio.Event):
+        wakeups: dict[int, asyncio.Event] = {}
+        tasks: list[asyncio.Task] = []
+
+        def on_notify(connection, pid, channel, payload):
+            shards = [int(shard) for shard in payload.split(",") if shard] or wakeups
+            for shard in shards:
+                if shard in wakeups:
+                    wakeups[shard].set()
+
+        def start_shards():
+            for shard in self.locked_shards:
+                if shard not in wakeups:
+                    wakeups[shard] = asyncio.Event()
+                    tasks.append(asyncio.create_task(self._run_shard(shard, wakeups[shard], stop)))
+
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        # Отдельное соединение на всё время работы: на нём висят блокировки шардов и LISTEN
+        async with db.acquire() as conn:
+            await self._lock_shards(conn)
+            await conn.add_listener(db.UPDATE_QUEUE_CHANNEL, on_notify)
+            logger.info("Воркер %s/%s обрабатывает шарды %s", WORKER_INDEX, WORKER_COUNT, self.locked_shards)
+            try:
+                start_shards()
+                while not stop.is_set() and len(self.locked_shards) < len(self.shards):
+                    await _wait(stop, LOCK_RETRY_INTERVAL_SEC)
+                    if not stop.is_set():
+                        await self._lock_shards(conn)
+                        start_shards()
+                await stop.wait()
+                for wakeup in wakeups.values():
+                    wakeup.set()
+                # Циклы шардов дорабатывают текущее обновление и выходят по stop
+                await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await conn.remove_listener(db.UPDATE_QUEUE_CHANNEL, on_notify)
+                await conn.execute("SELECT pg_advisory_unlock_all()")
+                await self.dp.emit_shutdown(bot=self.bot, **workflow_data)